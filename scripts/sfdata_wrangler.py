@@ -321,8 +321,7 @@ if __name__ == "__main__":
         startTime = datetime.datetime.now()  
         sfmuniHelper = SFMuniDataHelper()
         sfmuniHelper.readRouteEquiv(ROUTE_EQUIV) 
-        for infile in RAW_STP_FILES: 
-            sfmuniHelper.processRawData(infile, CLEANED_OUTFILES_STEP1[0])
+        sfmuniHelper.processRawDataFiles(RAW_STP_FILES, CLEANED_OUTFILES_STEP1[0])
         print ('Finished cleaning step 1 SFMuni data in ', (datetime.datetime.now() - startTime))
 
     # update RouteEquiv and write to separate files by year
@@ -216,6 +216,7 @@ if __name__ == "__main__":
         
         # individual trajectory plots
         vizualizer.plotTrajectories(TRAJ_VIZ_OUTFILE, trajSpecs=TRAJ_VIZ_SPECS)  
+        vizualizer.close()
           
         print 'Finished vizualizing data in ', (datetime.datetime.now() - startTime)
         
@@ -660,8 +660,8 @@ class DemandHelper():
                 monthly.drop('total', axis=1)
     
             # get the july data as the annual measures for each year
-            monthly['YEAR'] = monthly['MONTH'].apply(lambda x: x.year)
-            monthly['M'] = monthly['MONTH'].apply(lambda x: x.month)
+            monthly['YEAR'] = monthly['MONTH'].dt.year
+            monthly['M'] = monthly['MONTH'].dt.month
             annual = monthly[monthly['M']==7]
             
             # set the fips code
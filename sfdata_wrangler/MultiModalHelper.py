@@ -193,11 +193,12 @@ class MultiModalHelper():
             outstore.remove('exrapolatedServiceMiles')
         
         # get the more detailed GTFS data
-        gtfs_store = pd.HDFStore(gtfsFile)
+        gtfs_store = pd.HDFStore(gtfsFile, mode='r')
         gtfs_bart     = gtfs_store.select('bartMonthly', where='DOW=1 and ROUTE_TYPE=1')
         gtfs_munibus  = gtfs_store.select('sfmuniMonthly', where='DOW=1 and ROUTE_TYPE=3')
         gtfs_munirail = gtfs_store.select('sfmuniMonthly', where='DOW=1 and ROUTE_TYPE=0')
         gtfs_municc   = gtfs_store.select('sfmuniMonthly', where='DOW=1 and ROUTE_TYPE=5')  
+        gtfs_store.close()
         
         # get the monthly service miles from the stat summary, and merge with BART so we 
         # get the key names right below...
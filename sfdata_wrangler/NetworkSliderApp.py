@@ -30,11 +30,14 @@ instructions on running.
 """
 
 import logging
+import threading
 
 logging.basicConfig(level=logging.DEBUG)
 
 from collections import OrderedDict
 
+import numpy as np
+
 from bokeh.plotting import figure
 from bokeh.models import Plot, ColumnDataSource, HoverTool
 from bokeh.properties import Instance
@@ -42,7 +45,7 @@ from bokeh.server.app import bokeh_app
 from bokeh.server.utils.plugins import object_page
 from bokeh.models.widgets import VBox, Slider, VBoxForm
 
-from Visualizer import Visualizer
+from Visualizer import Visualizer, LINK_COLORS
 from HwyNetwork import HwyNetwork
 
 # global parameters
@@ -51,6 +54,11 @@ INPUT_DYNAMEQ_NET_PREFIX = "pb_july19_830p"
 TAXI_OUTFILE = "C:/CASA/DataExploration/taxi.h5"     
 LOGGING_DIR = "C:/CASA/DataExploration"
 
+# prepared (linkData, segmentData) by date, kept for the life of the 
+# server so a new session doesn't re-read the network and the data
+PREPARED_DATA = {}
+PREPARED_DATA_LOCK = threading.Lock()
+
 class NetworkSliderApp(VBox):
     """An example of a browser-based, interactive plot with slider controls."""
 
@@ -195,19 +203,23 @@ class NetworkSliderApp(VBox):
         select the appropriate columns for this hour
         """
         
+        # the hourly colors stay on the server, and are only 
+        # prepared once, so this is just a lookup after the first time
+        (linkData, segmentData) = self.prepareLinkData()
+        
         # initialize the first time through
         if len(self.allLinkData.data['X']) == 0:
-            (linkData, segmentData) = self.prepareLinkData()
-            self.allLinkData.data = linkData
+            self.allLinkData.data = dict(X=linkData['X'], 
+                                         Y=linkData['Y'], 
+                                         LANES=linkData['LANES'])
             self.allSegmentData.data = segmentData        
         
         h = str(self.hour.value)
         
-        colorString = 'color' + h
         self.selectedLinkData.data = dict(X=self.allLinkData.data['X'], 
                                           Y=self.allLinkData.data['Y'], 
                                           LANES=self.allLinkData.data['LANES'], 
-                                          color=self.allLinkData.data[colorString])
+                                          color=linkData['color'][:, self.hour.value])
 
         self.selectedSegmentData.data = dict(xmid=self.allSegmentData.data['xmid'], 
                                              ymid=self.allSegmentData.data['ymid'],
@@ -221,24 +233,37 @@ class NetworkSliderApp(VBox):
                                              observations=self.allSegmentData.data['observations'+h])
 
         self.plot.title = "SF Taxi Speeds for Hour: " + h + ":00"
-
-        print 'updating to hour ' + h
             
 
     def prepareLinkData(self, date='2009-02-13'):
         """ 
-        Reads and returns a tuple of (linkData, segmentData). 
-        
-        linkData is a dictionary with one record for each link, containing 
-        the data necessary for plotting. 
-        
-        segmentData is a dictionary with one record for each shape segment
-        for use with the HoverTool. 
-        
-        Called once at the beginning to read in all the data. 
-        
-        date - string for the date's data to display
+        Returns the tuple of (linkData, segmentData) for the date.  
+        See prepareLinkData() below. 
         """
+        return prepareLinkData(date)
+
+
+def prepareLinkData(date='2009-02-13'):
+    """ 
+    Reads and returns a tuple of (linkData, segmentData). 
+    
+    linkData is a dictionary with one record for each link, containing 
+    the data necessary for plotting.  The colors are a single matrix
+    with one row for each link and one column for each hour. 
+    
+    segmentData is a dictionary with one record for each shape segment
+    for use with the HoverTool. 
+    
+    Called once when the server starts to read in all the data. 
+    
+    date - string for the date's data to display
+    """
+    
+    # only prepare each date once per server.  A session that starts 
+    # while the data are being prepared waits for them to finish. 
+    with PREPARED_DATA_LOCK: 
+        if date in PREPARED_DATA: 
+            return PREPARED_DATA[date]
         
         # read the highway network
         hwynet = HwyNetwork()
@@ -250,16 +275,33 @@ class NetworkSliderApp(VBox):
 
         # convert to a dictionary.  
         # .to_dict() returns in a different structure that doesn't work. 
+        # the colors are kept as indices, so look up the actual colors
+        # the shape points are kept as float32 arrays rather than lists
         linkData = {}
         for c in df.columns: 
-            linkData[c] = df[c]
+            if c in ['X', 'Y']: 
+                linkData[c] = [np.asarray(vals, dtype=np.float32) for vals in df[c]]
+            elif not c.startswith('color'): 
+                linkData[c] = df[c].values
+        colorColumns = ['color' + str(hour) for hour in range(0, 24)]
+        linkData['color'] = LINK_COLORS[df[colorColumns].values]
                 
         # convert to segments
         segmentData = v.getSegmentRectangleData(df)
+        v.close()
+        
+        PREPARED_DATA[date] = (linkData, segmentData)
                                 
         return (linkData, segmentData)
 
 
+# start preparing the data when the server loads this script, 
+# rather than when the first user connects
+warmup = threading.Thread(target=prepareLinkData)
+warmup.daemon = True
+warmup.start()
+
+
 """
 To view this applet directly from a bokeh server, you need to run a 
 bokeh-server and point it at the script.  First navigate to a directory
@@ -340,7 +340,7 @@ class SFMuniDataAggregator():
 
                 
         # open the output file
-        instore = pd.HDFStore(daily_file)
+        instore = pd.HDFStore(daily_file, mode='r')
         
         # do this month-by-month to save memory
         months = instore.select_column('rs_tod', 'MONTH').unique()
@@ -646,7 +646,7 @@ class SFMuniDataAggregator():
         print('Aggregating route stops to routes') 
 
         # establish the output file      
-        instore = pd.HDFStore(monthly_ts_file)
+        instore = pd.HDFStore(monthly_ts_file, mode='r')
         outstore = pd.HDFStore(monthly_trip_file)
         
         # remove the tables to be replaced
@@ -446,7 +446,7 @@ class SFMuniDataExpander():
         # and write a separate table for each month and DOW
         # format of the table name is mYYYYMMDDdX, where X is the day of week
         month = ((pd.to_datetime(date)).to_period('M')).to_timestamp()    
-        sfmuni_store = pd.HDFStore(getOutfile(self.sfmuni_file, month))
+        sfmuni_store = pd.HDFStore(getOutfile(self.sfmuni_file, month), mode='r')
         sfmuni_key = getInkey(month, 'm')
                 
         sfmuni = sfmuni_store.select(sfmuni_key, where='DATE==Timestamp(date)')
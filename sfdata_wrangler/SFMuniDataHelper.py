@@ -21,6 +21,8 @@ __license__     = """
     along with sfdata_wrangler.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import os
+import multiprocessing
 import pandas as pd
 import numpy as np
 import datetime
@@ -37,6 +39,21 @@ def getOutkey(month, prefix):
     gets the key name as a string from the month and the day of week
     """
     return prefix + str(month.date()).replace('-', '')
+
+
+def processRawDataInProcess(args):
+    """
+    Converts one raw file to its own HDF5 file using a new helper.  This 
+    is at the module level so it can be run in a multiprocessing pool.
+    
+    args - tuple of (infile, outfile)
+    """
+    (infile, outfile) = args
+    
+    helper = SFMuniDataHelper()
+    helper.processRawData(infile, outfile)
+    
+    return outfile
     
                                     
 class SFMuniDataHelper():
@@ -383,6 +400,78 @@ class SFMuniDataHelper():
         self.routeEquiv = df
         
     
+    def getStringLengths(self): 
+        """
+        Returns a dictionary of the lengths of the string columns written
+        by processRawData.  
+        """
+        stringLengths= {}
+        for col in self.COLUMNS: 
+            if (col[2]=='object' and col[3]>0 and 
+                (col[0] in self.REORDERED_COLUMNS)): 
+                stringLengths[col[0]] = col[3]
+        stringLengths['AGENCY_ID']        = 10
+        stringLengths['ROUTE_SHORT_NAME'] = 10
+        stringLengths['ROUTE_LONG_NAME']  = 32
+        
+        return stringLengths
+        
+    
+    def processRawDataFiles(self, infiles, outfile): 
+        """
+        Reads several files of SFMuniData, and cleans, processes and writes
+        them to an HDF5 file.  The files are converted in parallel, each to 
+        its own temporary file, and then appended to outfile in order.  
+        
+        So every row is written twice, once to a temporary file and once 
+        to outfile, and there must be disk space next to outfile for the 
+        converted data a second time until the temporary files are deleted.  
+        
+        infiles - list of files in "raw STP" format
+        outfile - output file name in h5 format
+        """
+        
+        # the temporary files go next to the output
+        base = os.path.splitext(outfile)[0]
+        tasks = []
+        for i, infile in enumerate(infiles): 
+            partfile = base + '_part' + str(i) + '.h5'
+            if os.path.exists(partfile): 
+                os.remove(partfile)
+            tasks.append((infile, partfile))
+        
+        # nothing to convert
+        if len(tasks)==0: 
+            return
+        
+        # the temporary files are removed even if a conversion fails, 
+        # because they take as much space as the output
+        try: 
+            pool = multiprocessing.Pool(min(len(tasks), multiprocessing.cpu_count()))
+            try: 
+                partfiles = pool.map(processRawDataInProcess, tasks)
+            finally: 
+                pool.close()
+                pool.join()
+            
+            # append them in order, chunk by chunk so we don't run out of memory
+            stringLengths = self.getStringLengths()
+            with pd.HDFStore(outfile) as store: 
+                for partfile in partfiles: 
+                    print (datetime.datetime.now().ctime(), 'Appending converted data in file: ', partfile)
+                    
+                    with pd.HDFStore(partfile, mode='r') as partstore: 
+                        for df in partstore.select('sample', chunksize=self.CHUNKSIZE): 
+                            store.append('sample', df, data_columns=True, 
+                                min_itemsize=stringLengths, 
+                                complib='blosc', complevel=5)
+                    os.remove(partfile)
+        finally: 
+            for infile, partfile in tasks: 
+                if os.path.exists(partfile): 
+                    os.remove(partfile)
+        
+    
     def processRawData(self, infile, outfile):
         """
         Read SFMuniData, cleans it, processes it, and writes it to an HDF5 file.
@@ -397,17 +486,11 @@ class SFMuniDataHelper():
         colnames = []       
         colspecs = []
         coltypes = []
-        stringLengths= {}
         for col in self.COLUMNS: 
             colnames.append(col[0])
             colspecs.append(col[1])
             coltypes.append(col[2])
-            if (col[2]=='object' and col[3]>0 and 
-                (col[0] in self.REORDERED_COLUMNS)): 
-                stringLengths[col[0]] = col[3]
-        stringLengths['AGENCY_ID']        = 10
-        stringLengths['ROUTE_SHORT_NAME'] = 10
-        stringLengths['ROUTE_LONG_NAME']  = 32
+        stringLengths = self.getStringLengths()
 
         # set up the reader -- one file is a different format
         reader = None 
@@ -533,7 +616,8 @@ class SFMuniDataHelper():
             # write the data
             try: 
                 store.append('sample', df, data_columns=True, 
-                    min_itemsize=stringLengths)
+                    min_itemsize=stringLengths, 
+                    complib='blosc', complevel=5)
             except ValueError: 
                 print ('Structure of current dataframe is: ')
                 print (df.dtypes)
@@ -566,7 +650,7 @@ class SFMuniDataHelper():
         missingRouteIds = set()
 
         # loop through these dates
-        store = pd.HDFStore(infile) 
+        store = pd.HDFStore(infile, mode='r') 
         dates = store.select_column('sample', 'DATE').unique()
         dates = sorted(dates)
         print(datetime.datetime.now().ctime(), 'Writing data for periods from ', dates[0], ' to ', dates[-1]) 
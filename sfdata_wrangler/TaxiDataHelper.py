@@ -537,6 +537,16 @@ class TaxiDataHelper():
             # TODO: switch this to month, dow
             aggregated['date'] = date
             
-            # write the data
-            store.append(outkey, aggregated, data_columns=True)
-
+            # write the data, compressed because the visualizer reads 
+            # it back one date at a time.  The expected size lets PyTables
+            # pick chunks to suit the whole table, rather than the first date. 
+            store.append(outkey, aggregated, data_columns=True, 
+                complib='blosc', complevel=5, 
+                expectedrows=len(aggregated)*len(dates))
+        
+        # a full index on the date, which is what the visualizer 
+        # selects on
+        store.create_table_index(outkey, columns=['date'], optlevel=9, kind='full')
+        
+        # all done
+        store.close()
@@ -24,11 +24,12 @@ __license__     = """
 """
 
 import os
+import multiprocessing
 import numpy as np
 import pandas as pd
 import datetime
+from collections import OrderedDict
 from xlsxwriter.utility import xl_rowcol_to_cell
-import bokeh.plotting as bk
 
 
 def convertDateToMonth(date):
@@ -41,7 +42,134 @@ def convertDateToMonth(date):
         month = ((pd.to_datetime(date)).to_period('M')).to_timestamp() 
         return month
 
+
+# cache of excel cell names, which are looked up repeatedly for the 
+# same cells when writing the formulas
+CELL_NAMES = {}
+
+def cellName(row, col):
+    '''
+    Returns the excel name of the cell (e.g. 'B3') for a zero-indexed 
+    row and column.  
+    '''
+    key = (row, col)
+    if key not in CELL_NAMES: 
+        CELL_NAMES[key] = xl_rowcol_to_cell(row, col)
+    return CELL_NAMES[key]
+
+
+def fillMissingMonths(df):
+    '''
+    Indexes df by MONTH, with a row for every month from the first to the 
+    last, so any missing months show up as missing.  The months must be 
+    unique and labelled by the first day of the month, so this is a 
+    straight reindex rather than a resample.  
+    '''
+    df = df.set_index('MONTH', drop=False).sort_index()
+    if not isinstance(df.index, pd.DatetimeIndex): 
+        df.index = pd.to_datetime(df.index)
+    
+    # the MONTH column only needs filling if months were added
+    numMonths = len(df)
+    df = df.asfreq('MS')
+    if len(df) > numMonths: 
+        df['MONTH'] = df.index
+    return df
+
+
+def joinOnMonth(df, tables):
+    '''
+    Left joins each of the tables to df on MONTH, all in one pass. 
+    
+    tables - list of (table, suffix) tuples.  As with a merge, the suffix
+             is added to any column name that is already in use. 
+    '''
+    df = df.set_index('MONTH')
+    
+    columns = set(df.columns)
+    renamed = []
+    for table, suffix in tables: 
+        table = table.set_index('MONTH')
+        table = table.rename(columns=lambda c: c+suffix if c in columns else c)
+        columns.update(table.columns)
+        renamed.append(table)
+        
+    df = df.join(renamed, how='left').sort_index()
+    
+    return df.reset_index()
+
+
+def addThreeCountyFields(df, columns): 
+    '''
+    For each numeric column with a 4-county _Total and an SF-only _SFC 
+    version in df, adds the 3-county total (_3COUNTY) and the SF share 
+    (_SFSHARE).  These are calculated as whole blocks, and added to df 
+    in one step rather than one column at a time.  
+    
+    columns - the names of the demand columns, without suffixes
+    '''
+    columns = [col for col in columns 
+               if col+'_Total' in df.columns 
+               and df[col+'_Total'].dtype in (np.float64, np.int64)]
+    
+    total = df[[col+'_Total' for col in columns]]
+    sf    = df[[col+'_SFC' for col in columns]]
+    total.columns = columns
+    sf.columns = columns
+    
+    threeCounty = (total - sf).add_suffix('_3COUNTY')
+    sfShare = (sf / total).add_suffix('_SFSHARE')
+    
+    # keep the pairs of fields together, as they were when added one by one
+    order = []
+    for col in columns: 
+        order += [col+'_3COUNTY', col+'_SFSHARE']
+    
+    return pd.concat([df, threeCounty, sfShare], axis=1)[list(df.columns) + order]
+
+
+def downcastIntegers(df): 
+    '''
+    Stores each integer column of df in the smallest integer type that 
+    holds its values.  Floats are left as they are, so the estimation 
+    files don't lose any precision. 
+    '''
+    for col in df.select_dtypes(include=[np.int64]).columns: 
+        df[col] = pd.to_numeric(df[col], downcast='integer')
+    return df
+
+
+def writeEstimationData(df, estfile, fmt='csv'): 
+    '''
+    Writes the estimation data to a file.  Parquet is much faster to 
+    write and read back than csv for these wide tables, but needs pyarrow.
     
+    fmt - 'csv' writes to estfile, 'parquet' writes to the same path 
+          with a .parquet extension
+    '''
+    if fmt=='parquet': 
+        base = os.path.splitext(estfile)
+        df.to_parquet(base[0] + '.parquet', engine='pyarrow', compression='snappy')
+    else: 
+        df.to_csv(estfile)
+
+
+def assembleDemandDataInProcess(args):
+    '''
+    Assembles the demand data for one county using a new reporter.  This
+    is at the module level so it can be run in a multiprocessing pool.
+    
+    args - tuple of (input files, shared cost tables, fips), where the
+           files are in the order taken by the TransitReporter constructor
+    '''
+    (files, sharedCostTables, fips) = args
+    
+    reporter = TransitReporter(*files)
+    reporter.sharedCostTables = sharedCostTables
+    
+    return reporter.assembleDemandData(fips)
+
+
 class TransitReporter():
     """ 
     Class to create transit performance reports and associated
@@ -64,100 +192,176 @@ class TransitReporter():
         self.worksheet = None
         self.row = None
         self.col = None
+        
+        # cost tables that are the same for all counties, read on first use
+        self.sharedCostTables = None
+        
+        # assembled data, kept so that the reports and estimation files
+        # don't each rebuild it
+        self.demandData = {}
+        self.monthlyMultiModalData = {}
+
 
+    def readSystemTables(self, fips, dow=1, tod=None, route_short_name='All'):
+        '''
+        Reads the input tables for the system performance data, opening
+        each store only once.  
+        
+        tod - the time-of-day to read, or None to read all of them at 
+              once so they can be shared by several sheets
+        
+        Returns a dictionary of dataframes keyed by the table name. 
+        '''
+        tables = {}
+        
+        # only read the trip fields that are used in the reports
+        dayColumns = ['MONTH', 'TRIPS', 'SERVMILES', 'SERVMILES_S', 'ON', 'OFF', 
+                      'RDBRDNGS', 'PASSMILES', 'PASSHOURS', 'WAITHOURS', 
+                      'WHEELCHAIR', 'BIKERACK', 'RUNSPEED', 'TOTSPEED', 
+                      'DWELL', 'TRIP_STOPS', 'HEADWAY_S', 'FULLFARE_REV', 
+                      'ONTIME5', 'PASSDELAY_DEP', 'PASSDELAY_ARR', 
+                      'VC', 'CROWDED', 'CROWDHOURS', 'NUMDAYS', 'OBSDAYS', 
+                      'OBS_TRIPS', 'IMP_TRIPS']
+        todColumns = dayColumns + ['TOD']
+        
+        with pd.HDFStore(self.trip_file, mode='r') as trip_store: 
+            # get list of months
+            tables['system_day'] = trip_store.select('system_day', where='DOW=dow', columns=dayColumns)
+        
+            if route_short_name=='All': 
+                if tod is None: 
+                    tables['system_tod'] = trip_store.select('system_tod', where='DOW=dow', columns=todColumns)
+                elif tod!='Daily': 
+                    tables['system_tod'] = trip_store.select('system_tod', where='DOW=dow & TOD=tod', columns=todColumns)
+            else: 
+                if tod=='Daily': 
+                    tables['route_day'] = trip_store.select('route_day', where='DOW=dow & ROUTE_SHORT_NAME=route_short_name', columns=dayColumns)
+                elif tod is None: 
+                    tables['route_tod'] = trip_store.select('route_tod', where='DOW=dow & ROUTE_SHORT_NAME=route_short_name', columns=todColumns)
+                else: 
+                    tables['route_tod'] = trip_store.select('route_tod', where='DOW=dow & TOD=tod & ROUTE_SHORT_NAME=route_short_name', columns=todColumns)
+        
+        # the times-of-day are picked out repeatedly, so compare them
+        # as category codes rather than as strings
+        for key in ['system_tod', 'route_tod']: 
+            if key in tables: 
+                tables[key]['TOD'] = tables[key]['TOD'].astype('category')
+        
+        with pd.HDFStore(self.demand_file, mode='r') as demand_store: 
+            tables['countyEmp'] = demand_store.select('countyEmp', where='FIPS=fips')
+            tables['countyPop'] = demand_store.select('countyPop', where='FIPS=fips')
+            tables['autoOpCost'] = demand_store.select('autoOpCost')
+        
+        return tables
+        
 
-    def assembleSystemPerformanceData(self, fips, dow=1, tod='Daily', route_short_name='All'):
+    def assembleSystemPerformanceData(self, fips, dow=1, tod='Daily', route_short_name='All', 
+                                      tables=None, maskZeros=False):
         '''
         Calculates the fields used in the system performance reports
         and stores them in an HDF datastore. 
+        
+        tables - the input tables from readSystemTables(), or None to 
+                 read them for just this time-of-day
+        maskZeros - if True, ratios with a zero denominator are missing
+                    rather than infinite, so the report cells are blank.  
+                    The estimation files leave this off. 
         '''   
-        # open and join the input fields
-        trip_store = pd.HDFStore(self.trip_file)
-        ts_store = pd.HDFStore(self.ts_file)
-        demand_store = pd.HDFStore(self.demand_file)
-        
-        # get list of months
-        months = trip_store.select('system_day', where='DOW=dow')
-        months = months.set_index(pd.DatetimeIndex(months['MONTH']))
-        months = months.resample('M').first()
-        months['MONTH'] = months.index
-        months['MONTH'] = months['MONTH'].apply(pd.DateOffset(days=1)).apply(pd.DateOffset(months=-1))
-        months = months[['MONTH']].copy()
+        # get the input fields
+        if tables is None: 
+            tables = self.readSystemTables(fips, dow=dow, tod=tod, route_short_name=route_short_name)
+        
+        months = tables['system_day']
+        
+        if route_short_name=='All': 
+            level = 'system'
+        else: 
+            level = 'route'
         
         if tod=='Daily': 
-            if route_short_name=='All': 
-                trips = trip_store.select('system_day', where='DOW=dow')
-            else: 
-                trips = trip_store.select('route_day', where='DOW=dow & ROUTE_SHORT_NAME=route_short_name')
-                
+            trips = tables[level + '_day']
         else:
-            if route_short_name=='All': 
-                trips = trip_store.select('system_tod', where='DOW=dow & TOD=tod')
-            else: 
-                trips = trip_store.select('route_tod', where='DOW=dow & TOD=tod & ROUTE_SHORT_NAME=route_short_name')
+            trips = tables[level + '_tod']
+            trips = trips[trips['TOD']==tod]
         
+        employment = tables['countyEmp']
+        population = tables['countyPop']
+        autoOpCost = tables['autoOpCost']
         
-        employment = demand_store.select('countyEmp', where='FIPS=fips')
-        population = demand_store.select('countyPop', where='FIPS=fips')
-        autoOpCost = demand_store.select('autoOpCost')
+        months = fillMissingMonths(months[['MONTH']])
         
         # merge the service provided
         service_delivered = pd.read_csv(self.service_delivered_file, parse_dates=['MONTH'])
         trips = pd.merge(trips, service_delivered, how='left', on=['MONTH'], sort=True) 
-
-        trip_store.close()
-        ts_store.close()
-        demand_store.close()
                 
-        # resample so any missing months show up as missing   
-        # the offsets are to get it based on the first day of the month instead of the last     
-        trips = trips.set_index(pd.DatetimeIndex(trips['MONTH']))
-        trips = trips.resample('M').first()
-        trips['MONTH'] = trips.index
-        trips['MONTH'] = trips['MONTH'].apply(pd.DateOffset(days=1)).apply(pd.DateOffset(months=-1))
+        # so any missing months show up as missing   
+        trips = fillMissingMonths(trips)
                 
         
-        # now the indices are aligned, so we can just assign
-        df = months
-
-        df['TRIPS']          = trips['TRIPS']
-        df['SERVMILES']      = trips['SERVMILES']
-        df['SERVMILES_S']    = trips['SERVMILES_S']
-        df['SERV_DELIVERED'] = trips['MUNI_SERV_DELIVERED']
-        df['ON']             = trips['ON']
-        df['RDBRDNGS']       = trips['RDBRDNGS']
-        df['PASSMILES']      = trips['PASSMILES']
-        df['PASSHOURS']      = trips['PASSHOURS']
-        df['WHEELCHAIR']     = trips['WHEELCHAIR']
-        df['BIKERACK']       = trips['BIKERACK']
-        df['RUNSPEED'] 	     = trips['RUNSPEED']
-        df['TOTSPEED'] 	     = trips['TOTSPEED']
-        df['DWELL_PER_STOP'] = trips['DWELL']  / trips['TRIP_STOPS']
-        df['HEADWAY_S']      = trips['HEADWAY_S']
-        df['FARE_PER_PASS']  = trips['FULLFARE_REV'] / trips['ON']
-        df['MILES_PER_PASS'] = trips['PASSMILES'] / trips['ON']
-        df['IVT_PER_PAS']    = (trips['PASSHOURS'] / trips['ON']) * 60.0
-        df['PASSPEED']       = (df['MILES_PER_PASS'] / df['IVT_PER_PAS']) * 60.0
-        df['WAIT_PER_PAS']   = (trips['WAITHOURS'] / trips['ON']) * 60.0
-        df['ONTIME5']        = trips['ONTIME5']	
-        df['DELAY_DEP_PER_PASS'] = trips['PASSDELAY_DEP'] / trips['ON']
-        df['DELAY_ARR_PER_PASS'] = trips['PASSDELAY_ARR'] / trips['ON']
-        df['VC']             = trips['VC']        
-        df['CROWDED']        = trips['CROWDED']   
-        df['CROWDHOURS']     = trips['CROWDHOURS']
-        df['NUMDAYS']        = trips['NUMDAYS']
-        df['OBSDAYS']        = trips['OBSDAYS']
-        df['OBSERVED_PCT']   = trips['OBS_TRIPS'] / trips['TRIPS']
-        df['IMPUTED_PCT']    = trips['IMP_TRIPS'] / trips['TRIPS']
-        df['MEASURE_ERR']    = trips['OFF'] / trips['ON'] - 1.0
-        df['WEIGHT_ERR']     = trips['SERVMILES'] / trips['SERVMILES_S'] - 1.0
+        # now the indices are aligned, so the fields can be built up 
+        # together and put in the dataframe in one step
+        
+        # the denominators of the ratios, which are masked once for the 
+        # reports so the ratios are missing rather than infinite when 
+        # they are zero
+        boardings = trips['ON']
+        tripCount = trips['TRIPS']
+        tripStops = trips['TRIP_STOPS']
+        schedMiles = trips['SERVMILES_S']
+        if maskZeros: 
+            boardings = boardings.where(boardings > 0)
+            tripCount = tripCount.where(tripCount > 0)
+            tripStops = tripStops.where(tripStops > 0)
+            schedMiles = schedMiles.where(schedMiles > 0)
+        
+        milesPerPass = trips['PASSMILES'] / boardings
+        ivtPerPass   = (trips['PASSHOURS'] / boardings) * 60.0
+        measureErr   = trips['OFF'] / boardings - 1.0
+        weightErr    = trips['SERVMILES'] / schedMiles - 1.0
+        
+        fields = OrderedDict()
+        fields['MONTH']          = months['MONTH']
+        fields['TRIPS']          = trips['TRIPS']
+        fields['SERVMILES']      = trips['SERVMILES']
+        fields['SERVMILES_S']    = trips['SERVMILES_S']
+        fields['SERV_DELIVERED'] = trips['MUNI_SERV_DELIVERED']
+        fields['ON']             = trips['ON']
+        fields['RDBRDNGS']       = trips['RDBRDNGS']
+        fields['PASSMILES']      = trips['PASSMILES']
+        fields['PASSHOURS']      = trips['PASSHOURS']
+        fields['WHEELCHAIR']     = trips['WHEELCHAIR']
+        fields['BIKERACK']       = trips['BIKERACK']
+        fields['RUNSPEED']       = trips['RUNSPEED']
+        fields['TOTSPEED']       = trips['TOTSPEED']
+        fields['DWELL_PER_STOP'] = trips['DWELL']  / tripStops
+        fields['HEADWAY_S']      = trips['HEADWAY_S']
+        fields['FARE_PER_PASS']  = trips['FULLFARE_REV'] / boardings
+        fields['MILES_PER_PASS'] = milesPerPass
+        fields['IVT_PER_PAS']    = ivtPerPass
+        fields['PASSPEED']       = (milesPerPass / ivtPerPass) * 60.0
+        fields['WAIT_PER_PAS']   = (trips['WAITHOURS'] / boardings) * 60.0
+        fields['ONTIME5']        = trips['ONTIME5']	
+        fields['DELAY_DEP_PER_PASS'] = trips['PASSDELAY_DEP'] / boardings
+        fields['DELAY_ARR_PER_PASS'] = trips['PASSDELAY_ARR'] / boardings
+        fields['VC']             = trips['VC']        
+        fields['CROWDED']        = trips['CROWDED']   
+        fields['CROWDHOURS']     = trips['CROWDHOURS']
+        fields['NUMDAYS']        = trips['NUMDAYS']
+        fields['OBSDAYS']        = trips['OBSDAYS']
+        fields['OBSERVED_PCT']   = trips['OBS_TRIPS'] / tripCount
+        fields['IMPUTED_PCT']    = trips['IMP_TRIPS'] / tripCount
+        fields['MEASURE_ERR']    = measureErr
+        fields['WEIGHT_ERR']     = weightErr
 
         # additional fields for estimation
-        df['OFF_MINUS_ON']   = trips['OFF'] - trips['ON']
-        df['SERVMILES_MINUS_SERVMILES_S']   = trips['SERVMILES'] - trips['SERVMILES_S']
+        fields['OFF_MINUS_ON']   = trips['OFF'] - trips['ON']
+        fields['SERVMILES_MINUS_SERVMILES_S']   = trips['SERVMILES'] - trips['SERVMILES_S']
+        
+        fields['MEASURE_ERR_ON']  = measureErr * trips['ON']
+        fields['WEIGHT_ERR_ON']   = weightErr * trips['ON']
         
-        df['MEASURE_ERR_ON']  = df['MEASURE_ERR'] * df['ON']
-        df['WEIGHT_ERR_ON']   = df['WEIGHT_ERR'] * df['ON']
+        # the trip fields are lined up with the full list of months
+        df = pd.DataFrame(fields, index=months.index)
         
         
         # merge the drivers of demand data
@@ -170,8 +374,6 @@ class TransitReporter():
         # fuelPrice includes FUEL_PRICE and FUEL_PRICE_2010USD
         df = pd.merge(df, autoOpCost, how='left', on=['MONTH'], sort=True)  
         
-        df.to_csv('sysem_perf.csv')
-        
         return df
 
         
@@ -193,32 +395,37 @@ class TransitReporter():
         timestring = str(pd.Timestamp(datetime.datetime.now()))
         timestring = timestring.split('.')[0]
  
-        # establish the writer        
+        # establish the writer.  In constant memory mode, each row is 
+        # flushed to disk as soon as a later row is started, so every
+        # sheet below must be written strictly top to bottom.  
         writer = pd.ExcelWriter(xlsfile, engine='xlsxwriter',
-                        datetime_format='mmm-yyyy')        
+                        datetime_format='mmm-yyyy', 
+                        options={'constant_memory': True})        
+        
+        # the formats are shared by all the sheets
+        self.writer = writer
+        self.set_formats()
 
         # write a separate sheet for each TOD
         tods = ['Daily', '0300-0559', '0600-0859', '0900-1359', 
                 '1400-1559', '1600-1859', '1900-2159', '2200-0259'] 
+        
+        # read the inputs for all the TODs at once
+        tables = self.readSystemTables(fips, dow=dow)
                 
         for tod in tods: 
-                
-            # get the actual data
-            df = self.assembleSystemPerformanceData(fips=fips, dow=dow, tod=tod)    
-                                
-            # Write the month as the column headers
+            
+            # get the actual data, from the tables already read
+            df = self.assembleSystemPerformanceData(fips=fips, dow=dow, tod=tod, 
+                                                    tables=tables, maskZeros=True)
             months = df[['MONTH']]
-            months.T.to_excel(writer, sheet_name=tod, 
-                                startrow=11, startcol=4, header=False, index=False)
-                    
-    
-            # note that we have to call the pandas function first to get the
-            # excel sheet created properly, so now we can access that
+                                
+            # create the sheet directly, so the header rows can be 
+            # written before any of the data.  The months are written
+            # as the column headers with the values. 
             workbook  = writer.book
-            worksheet = writer.sheets[tod]
-            
-            # set up the formatting, with defaults
-            bold = workbook.add_format({'bold': 1})        
+            worksheet = workbook.add_worksheet(tod)
+            writer.sheets[tod] = worksheet
             
             # set the column widths
             worksheet.set_column(0, 1, 5)
@@ -228,24 +435,14 @@ class TransitReporter():
                     
             
             # write the header
-            worksheet.write(1, 1, 'SFMTA Transit Performance Report', bold)
-            worksheet.write(3, 1, 'Input Specification', bold)
-            worksheet.write(4, 2, 'Geographic Extent: ')
-            worksheet.write(4, 3, geography)
-            worksheet.write(5, 2, 'Day-of-Week: ')
-            worksheet.write(5, 3, dowString)
-            worksheet.write(6, 2, 'Time-of-Day: ')
-            worksheet.write(6, 3, tod)
-            worksheet.write(7, 2, 'Report Generated on: ')
-            worksheet.write(7, 3, timestring)
-            worksheet.write(8, 2, 'Comments: ')      
-            worksheet.write(8, 3, comments)        
+            self.write_system_header(worksheet, geography, dowString, tod, 
+                                     timestring, comments)
             
             
             # Use formulas to calculate the differences
-            self.writeSystemValues(df, writer, months, tod)
-            self.writeSystemDifferenceFormulas(writer, months, tod)
-            self.writeSystemPercentDifferenceFormulas(writer, months, tod)    
+            self.writeSystemValues(df, writer, worksheet, months)
+            self.writeSystemDifferenceFormulas(worksheet, months)
+            self.writeSystemPercentDifferences(df, writer, worksheet, months)    
             
             # freeze so we can see what's happening
             worksheet.freeze_panes(0, 4)
@@ -274,16 +471,19 @@ class TransitReporter():
         # establish the writer        
         writer = pd.ExcelWriter(xlsfile, engine='xlsxwriter',
                         datetime_format='mmm-yyyy')        
+        
+        # the formats are shared by all the sheets
+        self.writer = writer
+        self.set_formats()
 
         # get the routes from the equiv file       
         routes = self.getRouteNames(routeEquivFile)
         
         # write the first sheet of ridership for each route        
-        trip_store = pd.HDFStore(self.trip_file)
-        df = trip_store.select('route_day', where="DOW=1")
+        with pd.HDFStore(self.trip_file, mode='r') as trip_store: 
+            df = trip_store.select('route_day', where="DOW=1")
         df = df[['MONTH', 'ROUTE_SHORT_NAME', 'ON']]
         df = df.pivot(index='MONTH', columns='ROUTE_SHORT_NAME')
-        trip_store.close()
          
         self.writeRouteSummary(df, writer, 'Routes', routes)
         
@@ -291,21 +491,16 @@ class TransitReporter():
         for route_short_name, route_long_name in routes: 
                 
             # get the actual data
-            df = self.assembleSystemPerformanceData(fips=fips, dow=dow, tod='Daily', route_short_name=route_short_name)    
-                                
-            # Write the month as the column headers
+            df = self.assembleSystemPerformanceData(fips=fips, dow=dow, tod='Daily', 
+                                                    route_short_name=route_short_name, 
+                                                    maskZeros=True)    
             months = df[['MONTH']]
-            months.T.to_excel(writer, sheet_name=route_short_name, 
-                                startrow=11, startcol=4, header=False, index=False)
-                    
-        
-            # note that we have to call the pandas function first to get the
-            # excel sheet created properly, so now we can access that
+                                
+            # create the sheet directly.  The months are written as the 
+            # column headers with the values. 
             workbook  = writer.book
-            worksheet = writer.sheets[route_short_name]
-            
-            # set up the formatting, with defaults
-            bold = workbook.add_format({'bold': 1})        
+            worksheet = workbook.add_worksheet(route_short_name)
+            writer.sheets[route_short_name] = worksheet
             
             # set the column widths
             worksheet.set_column(0, 1, 5)
@@ -315,24 +510,14 @@ class TransitReporter():
                     
             
             # write the header
-            worksheet.write(1, 1, 'SFMTA Transit Performance Report', bold)
-            worksheet.write(3, 1, 'Input Specification', bold)
-            worksheet.write(4, 2, 'Geographic Extent: ')
-            worksheet.write(4, 3, route_long_name)
-            worksheet.write(5, 2, 'Day-of-Week: ')
-            worksheet.write(5, 3, dowString)
-            worksheet.write(6, 2, 'Time-of-Day: ')
-            worksheet.write(6, 3, 'Daily')
-            worksheet.write(7, 2, 'Report Generated on: ')
-            worksheet.write(7, 3, timestring)
-            worksheet.write(8, 2, 'Comments: ')      
-            worksheet.write(8, 3, comments)        
+            self.write_system_header(worksheet, route_long_name, dowString, 'Daily', 
+                                     timestring, comments)
             
             
             # Use formulas to calculate the differences
-            self.writeSystemValues(df, writer, months, route_short_name)
-            self.writeSystemDifferenceFormulas(writer, months, route_short_name)
-            self.writeSystemPercentDifferenceFormulas(writer, months, route_short_name)    
+            self.writeSystemValues(df, writer, worksheet, months)
+            self.writeSystemDifferenceFormulas(worksheet, months)
+            self.writeSystemPercentDifferences(df, writer, worksheet, months)    
             
             # freeze so we can see what's happening
             worksheet.freeze_panes(0, 4)
@@ -366,12 +551,7 @@ class TransitReporter():
         
         # Write the month as the column headers
         
-        months = pd.DataFrame(df.index)
-        months = months.set_index(pd.DatetimeIndex(months['MONTH']))
-        months = months.resample('M').first()
-        months['MONTH'] = months.index
-        months['MONTH'] = months['MONTH'].apply(pd.DateOffset(days=1)).apply(pd.DateOffset(months=-1))
-        months.index = months['MONTH']
+        months = fillMissingMonths(pd.DataFrame(df.index))
         months.T.to_excel(writer, sheet_name='Routes', 
                                 startrow=11, startcol=4, header=False, index=False)
         
@@ -383,16 +563,8 @@ class TransitReporter():
         timestring = timestring.split('.')[0]
         
         # get the worksheet
-        workbook  = writer.book
         worksheet = writer.sheets[sheet]        
         
-        # set up the formatting, with defaults
-        bold = workbook.add_format({'bold': 1})
-        int_format = workbook.add_format({'num_format': '#,##0'})
-        dec_format = workbook.add_format({'num_format': '#,##0.00'})
-        money_format = workbook.add_format({'num_format': '$#,##0.00'})
-        percent_format = workbook.add_format({'num_format': '0.0%'})
-        
         # set the column widths
         worksheet.set_column(0, 1, 5)
         worksheet.set_column(0, 1, 8)
@@ -400,26 +572,16 @@ class TransitReporter():
         worksheet.set_column(3, 3, 25)
         
         # write the header
-        worksheet.write(1, 1, 'SFMTA Transit Performance Report', bold)
-        worksheet.write(3, 1, 'Input Specification', bold)
-        worksheet.write(4, 2, 'Geographic Extent: ')
-        worksheet.write(4, 3, 'All busses, by route')
-        worksheet.write(5, 2, 'Day-of-Week: ')
-        worksheet.write(5, 3, 'Average Weekday')
-        worksheet.write(6, 2, 'Time-of-Day: ')
-        worksheet.write(6, 3, 'Daily')
-        worksheet.write(7, 2, 'Report Generated on: ')
-        worksheet.write(7, 3, timestring)
-        worksheet.write(8, 2, 'Comments: ')      
-        worksheet.write(8, 3, comments)                
+        self.write_system_header(worksheet, 'All busses, by route', 'Average Weekday', 'Daily', 
+                                 timestring, comments)
                 
         # Write the data for each route       
                 
         # HEADER
-        worksheet.write(10, 4, 'Values', bold)
-        worksheet.write(11, 3, 'Trend', bold)
+        worksheet.write(10, 4, 'Values', self.bold)
+        worksheet.write(11, 3, 'Trend', self.bold)
         
-        worksheet.write(12, 1, 'Route', bold)
+        worksheet.write(12, 1, 'Route', self.bold)
         
         # write the header
         row = 13
@@ -429,7 +591,7 @@ class TransitReporter():
                 worksheet.write(row, 1, route_short_name)
                 worksheet.write(row, 2, route_long_name)         
             
-                worksheet.set_row(row, None, int_format) 
+                worksheet.set_row(row, None, self.int_format) 
                 row = row + 1
         
         # write the data
@@ -456,7 +618,61 @@ class TransitReporter():
         
     
     
-    def writeSystemValues(self, df, writer, months, sheet):
+    def getSystemSections(self):
+        '''
+        Returns the rows of the system values, as a list of sections.  Each
+        section has a header followed by rows of (label, column, format).
+        '''
+        return [
+            ('Drivers of Demand', [
+                ('Employment', 'TOTEMP', self.int_format),
+                ('Population', 'POP', self.int_format),
+                ('Average Fuel Price (2010 $)', 'FUEL_PRICE_2010USD', self.cent_format),
+                ]),
+            ('Service Provided', [
+                ('Vehicle Trips', 'TRIPS', self.int_format),
+                ('Service Miles', 'SERVMILES_S', self.int_format),
+                ('Percent of Service Delivered', 'SERV_DELIVERED', self.percent_format),
+                ]),
+            ('Ridership', [
+                ('Boardings', 'ON', self.int_format),
+                ('Rear-Door Boardings', 'RDBRDNGS', self.int_format),
+                ('Passenger Miles', 'PASSMILES', self.int_format),
+                ('Passenger Hours', 'PASSHOURS', self.int_format),
+                ('Wheelchairs Served', 'WHEELCHAIR', self.int_format),
+                ('Bicycles Served', 'BIKERACK', self.int_format),
+                ]),
+            ('Level-of-Service', [
+                ('Average Run Speed (mph)', 'RUNSPEED', self.dec_format),
+                ('Average Total Speed (mph)', 'TOTSPEED', self.dec_format),
+                ('Average Dwell Time per Stop (min)', 'DWELL_PER_STOP', self.dec_format),
+                ('Average Scheduled Headway (min)', 'HEADWAY_S', self.dec_format),
+                ('Average Full Fare ($)', 'FARE_PER_PASS', self.cent_format),
+                ('Average Distance Traveled per Passenger (mi)', 'MILES_PER_PASS', self.dec_format),
+                ('Average In-Vehicle Time per Passenger (min)', 'IVT_PER_PAS', self.dec_format),
+                ('Average Wait Time per Passenger (min)', 'WAIT_PER_PAS', self.dec_format),
+                ]),
+            ('Reliability', [
+                ('Percent of Vehicles Arriving On-Time (-1 to +5 min)', 'ONTIME5', self.percent_format),
+                ('Average Waiting Delay per Passenger (min)', 'DELAY_DEP_PER_PASS', self.dec_format),
+                ('Average Arrival Delay per Passenger (min)', 'DELAY_ARR_PER_PASS', self.dec_format),
+                ]),
+            ('Crowding', [
+                ('Average Volume-Capacity Ratio', 'VC', self.dec_format),
+                ('Percent of Trips with V/C > 0.85', 'CROWDED', self.percent_format),
+                ]),
+            ('Observations & Error', [
+                ('Number of Days', 'NUMDAYS', self.int_format),
+                ('Days with Observations', 'OBSDAYS', self.int_format),
+                ('Percent of Trips Observed', 'OBSERVED_PCT', self.percent_format),
+                ('Percent of Trips Imputed', 'IMPUTED_PCT', self.percent_format),
+                ('Measurement Error (ON/OFF-1)', 'MEASURE_ERR', self.percent_format),
+                ('Weighting Error (SERVMILES/SERVMILES_S-1)', 'WEIGHT_ERR', self.percent_format),
+                ]),
+            ]
+
+
+    def writeSystemValues(self, df, writer, worksheet, months):
         '''
         Writes the main system values to the worksheet. 
         '''
@@ -464,177 +680,32 @@ class TransitReporter():
         # which cells to look at
         max_col = 3+len(months)+1
         
-        # get the worksheet
-        workbook  = writer.book
-        worksheet = writer.sheets[sheet]        
-        
-        # set up the formatting, with defaults
-        bold = workbook.add_format({'bold': 1})
-        int_format = workbook.add_format({'num_format': '#,##0'})
-        dec_format = workbook.add_format({'num_format': '#,##0.00'})
-        money_format = workbook.add_format({'num_format': '$#,##0.00'})
-        percent_format = workbook.add_format({'num_format': '0.0%'})
-        
         # HEADER
-        worksheet.write(10, 4, 'Values', bold)
-        worksheet.write(11, 3, 'Trend', bold)
+        worksheet.write(10, 4, 'Values', self.bold)
+        worksheet.write(11, 3, 'Trend', self.bold)
+        worksheet.write_row(11, 4, months['MONTH'].dt.to_pydatetime(), self.date_format)
         
-        # DRIVERS OF DEMAND
-        worksheet.write(12, 1, 'Drivers of Demand', bold)
-        worksheet.write(13, 2, 'Employment')
-        worksheet.write(14, 2, 'Population')
-        worksheet.write(15, 2, 'Average Fuel Price (2010 $)')        
-
-        worksheet.set_row(13, None, int_format) 
-        worksheet.set_row(14, None, int_format) 
-        worksheet.set_row(15, None, money_format) 
-
-        selected = df[['TOTEMP', 'POP', 'FUEL_PRICE_2010USD']]
-        selected.T.to_excel(writer, sheet_name=sheet, 
-                            startrow=13, startcol=4, header=False, index=False)  
-
-        for r in range(13,16):
-            cell = xl_rowcol_to_cell(r, 3)
-            data_range = xl_rowcol_to_cell(r, 4) + ':' + xl_rowcol_to_cell(r, max_col)
-            worksheet.add_sparkline(cell, {'range': data_range})   
-
-
-        # SERVICE
-        worksheet.write(16, 1, 'Service Provided', bold)
-        worksheet.write(17, 2, 'Vehicle Trips')
-        worksheet.write(18, 2, 'Service Miles')
-        worksheet.write(19, 2, 'Percent of Service Delivered')
-
-        worksheet.set_row(17, None, int_format) 
-        worksheet.set_row(18, None, int_format) 
-        worksheet.set_row(19, None, percent_format) 
-
-        selected = df[['TRIPS', 'SERVMILES_S', 'SERV_DELIVERED']]
-        selected.T.to_excel(writer, sheet_name=sheet, 
-                            startrow=17, startcol=4, header=False, index=False)     
-                               
-        for r in range(17,20):
-            cell = xl_rowcol_to_cell(r, 3)
-            data_range = xl_rowcol_to_cell(r, 4) + ':' + xl_rowcol_to_cell(r, max_col)
-            worksheet.add_sparkline(cell, {'range': data_range})
-                        
-        # RIDERSHIP
-        worksheet.write(20, 1, 'Ridership', bold)     
-        worksheet.write(21, 2, 'Boardings')      
-        worksheet.write(22, 2, 'Rear-Door Boardings')      
-        worksheet.write(23, 2, 'Passenger Miles')      
-        worksheet.write(24, 2, 'Passenger Hours')      
-        worksheet.write(25, 2, 'Wheelchairs Served')    
-        worksheet.write(26, 2, 'Bicycles Served')  
-    
-        worksheet.set_row(21, None, int_format) 
-        worksheet.set_row(22, None, int_format) 
-        worksheet.set_row(23, None, int_format) 
-        worksheet.set_row(24, None, int_format) 
-        worksheet.set_row(25, None, int_format) 
-        worksheet.set_row(26, None, int_format) 
-
-        selected = df[['ON', 'RDBRDNGS', 'PASSMILES', 'PASSHOURS', 'WHEELCHAIR', 'BIKERACK']]
-        selected.T.to_excel(writer, sheet_name=sheet, 
-                            startrow=21, startcol=4, header=False, index=False)
-
-        for r in range(21,27):
-            cell = xl_rowcol_to_cell(r, 3)
-            data_range = xl_rowcol_to_cell(r, 4) + ':' + xl_rowcol_to_cell(r, max_col)
-            worksheet.add_sparkline(cell, {'range': data_range})
-                        
-        # LEVEL-OF-SERVICE
-        worksheet.write(27, 1, 'Level-of-Service', bold)      
-        worksheet.write(28, 2, 'Average Run Speed (mph)')      
-        worksheet.write(29, 2, 'Average Total Speed (mph)')      
-        worksheet.write(30, 2, 'Average Dwell Time per Stop (min)')      
-        worksheet.write(31, 2, 'Average Scheduled Headway (min)')      
-        worksheet.write(32, 2, 'Average Full Fare ($)')      
-        worksheet.write(33, 2, 'Average Distance Traveled per Passenger (mi)')      
-        worksheet.write(34, 2, 'Average In-Vehicle Time per Passenger (min)')      
-        worksheet.write(35, 2, 'Average Wait Time per Passenger (min)')      
-
-        worksheet.set_row(28, None, dec_format) 
-        worksheet.set_row(29, None, dec_format) 
-        worksheet.set_row(30, None, dec_format) 
-        worksheet.set_row(31, None, dec_format) 
-        worksheet.set_row(32, None, money_format) 
-        worksheet.set_row(33, None, dec_format) 
-        worksheet.set_row(34, None, dec_format) 
-        worksheet.set_row(35, None, dec_format) 
- 
-        selected = df[['RUNSPEED', 'TOTSPEED', 'DWELL_PER_STOP', 'HEADWAY_S', 'FARE_PER_PASS', 'MILES_PER_PASS', 'IVT_PER_PAS', 'WAIT_PER_PAS']]
-        selected.T.to_excel(writer, sheet_name=sheet, 
-                            startrow=28, startcol=4, header=False, index=False)
+        sections = self.getSystemSections()
         
-        for r in range(28,36):
-            cell = xl_rowcol_to_cell(r, 3)
-            data_range = xl_rowcol_to_cell(r, 4) + ':' + xl_rowcol_to_cell(r, max_col)
-            worksheet.add_sparkline(cell, {'range': data_range})
-                        
-        # RELIABILITY
-        worksheet.write(36, 1, 'Reliability', bold)    
-        worksheet.write(37, 2, 'Percent of Vehicles Arriving On-Time (-1 to +5 min)')       
-        worksheet.write(38, 2, 'Average Waiting Delay per Passenger (min)')       
-        worksheet.write(39, 2, 'Average Arrival Delay per Passenger (min)')       
-
-        worksheet.set_row(37, None, percent_format) 
-        worksheet.set_row(38, None, dec_format) 
-        worksheet.set_row(39, None, dec_format) 
-
-        selected = df[['ONTIME5', 'DELAY_DEP_PER_PASS', 'DELAY_ARR_PER_PASS']]
-        selected.T.to_excel(writer, sheet_name=sheet, 
-                            startrow=37, startcol=4, header=False, index=False)
+        # the data, one row at a time
+        self.set_position(writer, worksheet, 12, 2)
         
-        for r in range(37,40):
-            cell = xl_rowcol_to_cell(r, 3)
-            data_range = xl_rowcol_to_cell(r, 4) + ':' + xl_rowcol_to_cell(r, max_col)
-            worksheet.add_sparkline(cell, {'range': data_range})
+        for header, rows in sections: 
+            worksheet.write(self.row, 1, header, self.bold)
+            self.row += 1
             
-        # CROWDING
-        worksheet.write(40, 1, 'Crowding', bold)   
-        worksheet.write(41, 2, 'Average Volume-Capacity Ratio')       
-        worksheet.write(42, 2, 'Percent of Trips with V/C > 0.85')       
-        
-        selected = df[['VC', 'CROWDED']]
-        selected.T.to_excel(writer, sheet_name=sheet, 
-                            startrow=41, startcol=4, header=False, index=False)       
-        
-        worksheet.set_row(41, None, dec_format) 
-        worksheet.set_row(42, None, percent_format) 
-
-        for r in range(41,43):
-            cell = xl_rowcol_to_cell(r, 3)
-            data_range = xl_rowcol_to_cell(r, 4) + ':' + xl_rowcol_to_cell(r, max_col)
-            worksheet.add_sparkline(cell, {'range': data_range})
-
-        # OBSERVATIONS & ERROR
-        worksheet.write(43, 1, 'Observations & Error', bold)       
-        worksheet.write(44, 2, 'Number of Days')       
-        worksheet.write(45, 2, 'Days with Observations')       
-        worksheet.write(46, 2, 'Percent of Trips Observed')    
-        worksheet.write(47, 2, 'Percent of Trips Imputed')      
-        worksheet.write(48, 2, 'Measurement Error (ON/OFF-1)')       
-        worksheet.write(49, 2, 'Weighting Error (SERVMILES/SERVMILES_S-1)')      
-
-        worksheet.set_row(44, None, int_format) 
-        worksheet.set_row(45, None, int_format) 
-        worksheet.set_row(46, None, percent_format) 
-        worksheet.set_row(47, None, percent_format)
-        worksheet.set_row(48, None, percent_format)
-        worksheet.set_row(49, None, percent_format)
-
-        selected = df[['NUMDAYS', 'OBSDAYS', 'OBSERVED_PCT', 'IMPUTED_PCT', 'MEASURE_ERR', 'WEIGHT_ERR']]
-        selected.T.to_excel(writer, sheet_name=sheet, 
-                            startrow=44, startcol=4, header=False, index=False)  
-        
-        for r in range(44,50):
-            cell = xl_rowcol_to_cell(r, 3)
-            data_range = xl_rowcol_to_cell(r, 4) + ':' + xl_rowcol_to_cell(r, max_col)
-            worksheet.add_sparkline(cell, {'range': data_range})
+            # the row format has to be set before the row's cells are written
+            for label, column, format in rows: 
+                worksheet.set_row(self.row, None, format) 
+                worksheet.write_string(self.row, 2, label)
+                self.write_values(df[column].values, col=4)
+                
+                data_range = cellName(self.row, 4) + ':' + cellName(self.row, max_col)
+                worksheet.add_sparkline(self.row, 3, {'range': data_range})   
+                self.row += 1
             
             
-    def writeSystemDifferenceFormulas(self, writer, months, sheet): 
+    def writeSystemDifferenceFormulas(self, worksheet, months): 
         '''
         Adds formulas to the system worksheet to calculate differences
         from 12 months earlier. 
@@ -644,300 +715,88 @@ class TransitReporter():
         COL_OFFSET = 12
         max_col = 3+len(months)+1
         
-        # get the worksheet
-        workbook  = writer.book
-        worksheet = writer.sheets[sheet]        
-        
-        # set up the formatting, with defaults
-        bold = workbook.add_format({'bold': 1})
-        int_format = workbook.add_format({'num_format': '#,##0'})
-        dec_format = workbook.add_format({'num_format': '#,##0.00'})
-        money_format = workbook.add_format({'num_format': '$#,##0.00'})
-        percent_format = workbook.add_format({'num_format': '0.0%'})
+        # the columns with a value 12 months earlier to compare to
+        first_col = 4+COL_OFFSET
+        last_col = max_col-1
         
         # the header and labels
-        worksheet.write(52,4, 'Difference from 12 Months Before', bold)
-        worksheet.write(53,3, 'Difference Trend', bold)
-        months.T.to_excel(writer, sheet_name=sheet, 
-                            startrow=53, startcol=4, header=False, index=False)   
-        
-        
-        # DRIVERS OF DEMAND
-        worksheet.write(54, 1, 'Drivers of Demand', bold)        
-        
-        for r in range(55,58):
-            cell = xl_rowcol_to_cell(r, 2)
-            label = xl_rowcol_to_cell(r-ROW_OFFSET, 2)
-            worksheet.write_formula(cell, '='+label)
-            worksheet.set_row(r, None, int_format) 
-            
-            for c in range(4+COL_OFFSET, max_col):
-                cell = xl_rowcol_to_cell(r, c)
-                new = xl_rowcol_to_cell(r-ROW_OFFSET, c)
-                old = xl_rowcol_to_cell(r-ROW_OFFSET, c-COL_OFFSET)
-                worksheet.write_formula(cell, '=IF(ISNUMBER('+old+'),'+new+'-'+old+')')
-            
-            data_range = xl_rowcol_to_cell(r, 4) + ':' + xl_rowcol_to_cell(r, max_col)
-            worksheet.add_sparkline(r, 3, {'range': data_range, 
-                                           'type': 'column', 
-                                           'negative_points': True})      
+        worksheet.write(52,4, 'Difference from 12 Months Before', self.bold)
+        worksheet.write(53,3, 'Difference Trend', self.bold)
+        worksheet.write_row(53, 4, months['MONTH'].dt.to_pydatetime(), self.date_format)
+        
+        # the section headers, and the number format of each data row
+        headers = {54: 'Drivers of Demand', 
+                   58: 'Service Provided', 
+                   62: 'Ridership', 
+                   69: 'Level-of-Service', 
+                   78: 'Reliability', 
+                   82: 'Crowding'}
+        
+        formats = {}
+        for r in list(range(55,61)) + list(range(63,69)): 
+            formats[r] = self.int_format
+        for r in list(range(70,78)) + [80, 81, 83]: 
+            formats[r] = self.dec_format
+        for r in [61, 79, 84]: 
+            formats[r] = self.percent_format
+        formats[74] = self.cent_format
+        
+        # the data, one row at a time
+        for r in range(54,85):
+            if r in headers: 
+                worksheet.write(r, 1, headers[r], self.bold)
+            else: 
+                worksheet.set_row(r, None, formats[r]) 
+                worksheet.write_formula(cellName(r, 2), '='+cellName(r-ROW_OFFSET, 2))
                 
-        # SERVICE
-        worksheet.write(58, 1, 'Service Provided', bold)        
-        
-        for r in range(59,62):
-            cell = xl_rowcol_to_cell(r, 2)
-            label = xl_rowcol_to_cell(r-ROW_OFFSET, 2)
-            worksheet.write_formula(cell, '='+label)
-            worksheet.set_row(r, None, int_format) 
-            
-            for c in range(4+COL_OFFSET, max_col):
-                cell = xl_rowcol_to_cell(r, c)
-                new = xl_rowcol_to_cell(r-ROW_OFFSET, c)
-                old = xl_rowcol_to_cell(r-ROW_OFFSET, c-COL_OFFSET)
-                worksheet.write_formula(cell, '=IF(ISNUMBER('+old+'),'+new+'-'+old+')')
-            
-            data_range = xl_rowcol_to_cell(r, 4) + ':' + xl_rowcol_to_cell(r, max_col)
-            worksheet.add_sparkline(r, 3, {'range': data_range, 
-                                           'type': 'column', 
-                                           'negative_points': True})      
-                                           
-        worksheet.set_row(61, None, percent_format)      
-        
-        # RIDERSHIP
-        worksheet.write(62, 1, 'Ridership', bold)      
-            
-        for r in range(63,69):
-            cell = xl_rowcol_to_cell(r, 2)
-            label = xl_rowcol_to_cell(r-ROW_OFFSET, 2)
-            worksheet.write_formula(cell, '='+label)
-            worksheet.set_row(r, None, int_format) 
-            
-            for c in range(4+COL_OFFSET, max_col):
-                cell = xl_rowcol_to_cell(r, c)
-                new = xl_rowcol_to_cell(r-ROW_OFFSET, c)
-                old = xl_rowcol_to_cell(r-ROW_OFFSET, c-COL_OFFSET)
-                worksheet.write_formula(cell, '=IF(ISNUMBER('+old+'),'+new+'-'+old+')')
-            
-            data_range = xl_rowcol_to_cell(r, 4) + ':' + xl_rowcol_to_cell(r, max_col)
-            worksheet.add_sparkline(r, 3, {'range': data_range, 
-                                           'type': 'column', 
-                                           'negative_points': True})      
-        
-        # LEVEL-OF-SERVICE
-        worksheet.write(69, 1, 'Level-of-Service', bold)      
-        
-        for r in range(70,78):
-            cell = xl_rowcol_to_cell(r, 2)
-            label = xl_rowcol_to_cell(r-ROW_OFFSET, 2)
-            worksheet.write_formula(cell, '='+label)
-            worksheet.set_row(r, None, dec_format) 
-            
-            for c in range(4+COL_OFFSET, max_col):
-                cell = xl_rowcol_to_cell(r, c)
-                new = xl_rowcol_to_cell(r-ROW_OFFSET, c)
-                old = xl_rowcol_to_cell(r-ROW_OFFSET, c-COL_OFFSET)
-                worksheet.write_formula(cell, '=IF(ISNUMBER('+old+'),'+new+'-'+old+')')
-            
-            data_range = xl_rowcol_to_cell(r, 4) + ':' + xl_rowcol_to_cell(r, max_col)
-            worksheet.add_sparkline(r, 3, {'range': data_range, 
-                                           'type': 'column', 
-                                           'negative_points': True})      
-                           
-        worksheet.set_row(74, None, money_format) 
-        
-        # RELIABILITY
-        worksheet.write(78, 1, 'Reliability', bold)    
-        
-        for r in range(79,82):
-            cell = xl_rowcol_to_cell(r, 2)
-            label = xl_rowcol_to_cell(r-ROW_OFFSET, 2)
-            worksheet.write_formula(cell, '='+label)
-            worksheet.set_row(r, None, dec_format) 
-            
-            for c in range(4+COL_OFFSET, max_col):
-                cell = xl_rowcol_to_cell(r, c)
-                new = xl_rowcol_to_cell(r-ROW_OFFSET, c)
-                old = xl_rowcol_to_cell(r-ROW_OFFSET, c-COL_OFFSET)
-                worksheet.write_formula(cell, '=IF(ISNUMBER('+old+'),'+new+'-'+old+')')
-            
-            data_range = xl_rowcol_to_cell(r, 4) + ':' + xl_rowcol_to_cell(r, max_col)
-            worksheet.add_sparkline(r, 3, {'range': data_range, 
-                                           'type': 'column', 
-                                           'negative_points': True})      
-                        
-        worksheet.set_row(79, None, percent_format)      
-        
-        # CROWDING
-        worksheet.write(82, 1, 'Crowding', bold)   
-        
-        for r in range(83,85):
-            cell = xl_rowcol_to_cell(r, 2)
-            label = xl_rowcol_to_cell(r-ROW_OFFSET, 2)
-            worksheet.write_formula(cell, '='+label)
-            worksheet.set_row(r, None, int_format) 
-            
-            for c in range(4+COL_OFFSET, max_col):
-                cell = xl_rowcol_to_cell(r, c)
-                new = xl_rowcol_to_cell(r-ROW_OFFSET, c)
-                old = xl_rowcol_to_cell(r-ROW_OFFSET, c-COL_OFFSET)
-                worksheet.write_formula(cell, '=IF(ISNUMBER('+old+'),'+new+'-'+old+')')
-            
-            data_range = xl_rowcol_to_cell(r, 4) + ':' + xl_rowcol_to_cell(r, max_col)
-            worksheet.add_sparkline(r, 3, {'range': data_range, 
-                                           'type': 'column', 
-                                           'negative_points': True})      
-                          
-        worksheet.set_row(83, None, dec_format)              
-        worksheet.set_row(84, None, percent_format) 
+                # the formulas, as a single array formula across the row
+                if first_col <= last_col: 
+                    new = cellName(r-ROW_OFFSET, first_col) + ':' + cellName(r-ROW_OFFSET, last_col)
+                    old = cellName(r-ROW_OFFSET, first_col-COL_OFFSET) + ':' + cellName(r-ROW_OFFSET, last_col-COL_OFFSET)
+                    worksheet.write_array_formula(r, first_col, r, last_col, '=IF(ISNUMBER('+old+'),'+new+'-'+old+')')
+                
+                data_range = cellName(r, 4) + ':' + cellName(r, max_col)
+                worksheet.add_sparkline(r, 3, {'range': data_range, 
+                                               'type': 'column', 
+                                               'negative_points': True})      
         
         
-    def writeSystemPercentDifferenceFormulas(self, writer, months, sheet): 
+    def writeSystemPercentDifferences(self, df, writer, worksheet, months): 
         '''
-        Adds formulas to the system worksheet to calculate percent differences
-        from 12 months earlier. 
+        Writes the percent differences from 12 months earlier to the
+        system worksheet. 
         '''
         # which cells to look at
         ROW_OFFSET = 77
         COL_OFFSET = 12
         max_col = 3+len(months)+1
         
-        # get the worksheet
-        workbook  = writer.book
-        worksheet = writer.sheets[sheet]        
-        
-        # set up the formatting, with defaults
-        bold = workbook.add_format({'bold': 1})
-        percent_format = workbook.add_format({'num_format': '0.0%'})
-        
         # the header and labels
-        worksheet.write(87,4, 'Percent Difference from 12 Months Before', bold)
-        worksheet.write(88,3, 'Percent Difference Trend', bold)
-        months.T.to_excel(writer, sheet_name=sheet, 
-                            startrow=88, startcol=4, header=False, index=False)   
-        
-        # DRIVERS OF DEMAND
-        worksheet.write(89, 1, 'Drivers of Demand', bold)        
-        
-        for r in range(90,93):
-            cell = xl_rowcol_to_cell(r, 2)
-            label = xl_rowcol_to_cell(r-ROW_OFFSET, 2)
-            worksheet.write_formula(cell, '='+label)
-            worksheet.set_row(r, None, percent_format) 
-            
-            for c in range(4+COL_OFFSET, max_col):
-                cell = xl_rowcol_to_cell(r, c)
-                new = xl_rowcol_to_cell(r-ROW_OFFSET, c)
-                old = xl_rowcol_to_cell(r-ROW_OFFSET, c-COL_OFFSET)
-                worksheet.write_formula(cell, '='+new+'/'+old+'-1')
-            
-            data_range = xl_rowcol_to_cell(r, 4) + ':' + xl_rowcol_to_cell(r, max_col)
-            worksheet.add_sparkline(r, 3, {'range': data_range, 
-                                           'type': 'column', 
-                                           'negative_points': True})   
-
-        # SERVICE
-        worksheet.write(93, 1, 'Service Provided', bold)        
-        
-        for r in range(94,97):
-            cell = xl_rowcol_to_cell(r, 2)
-            label = xl_rowcol_to_cell(r-ROW_OFFSET, 2)
-            worksheet.write_formula(cell, '='+label)
-            worksheet.set_row(r, None, percent_format) 
-            
-            for c in range(4+COL_OFFSET, max_col):
-                cell = xl_rowcol_to_cell(r, c)
-                new = xl_rowcol_to_cell(r-ROW_OFFSET, c)
-                old = xl_rowcol_to_cell(r-ROW_OFFSET, c-COL_OFFSET)
-                worksheet.write_formula(cell, '='+new+'/'+old+'-1')
-            
-            data_range = xl_rowcol_to_cell(r, 4) + ':' + xl_rowcol_to_cell(r, max_col)
-            worksheet.add_sparkline(r, 3, {'range': data_range, 
-                                           'type': 'column', 
-                                           'negative_points': True})      
-        
-        # RIDERSHIP
-        worksheet.write(97, 1, 'Ridership', bold)      
-            
-        for r in range(98,104):
-            cell = xl_rowcol_to_cell(r, 2)
-            label = xl_rowcol_to_cell(r-ROW_OFFSET, 2)
-            worksheet.write_formula(cell, '='+label)
-            worksheet.set_row(r, None, percent_format) 
-            
-            for c in range(4+COL_OFFSET, max_col):
-                cell = xl_rowcol_to_cell(r, c)
-                new = xl_rowcol_to_cell(r-ROW_OFFSET, c)
-                old = xl_rowcol_to_cell(r-ROW_OFFSET, c-COL_OFFSET)
-                worksheet.write_formula(cell, '='+new+'/'+old+'-1')
-            
-            data_range = xl_rowcol_to_cell(r, 4) + ':' + xl_rowcol_to_cell(r, max_col)
-            worksheet.add_sparkline(r, 3, {'range': data_range, 
-                                           'type': 'column', 
-                                           'negative_points': True})      
-        
-        # LEVEL-OF-SERVICE
-        worksheet.write(104, 1, 'Level-of-Service', bold)      
-        
-        for r in range(105,113):
-            cell = xl_rowcol_to_cell(r, 2)
-            label = xl_rowcol_to_cell(r-ROW_OFFSET, 2)
-            worksheet.write_formula(cell, '='+label)
-            worksheet.set_row(r, None, percent_format) 
-            
-            for c in range(4+COL_OFFSET, max_col):
-                cell = xl_rowcol_to_cell(r, c)
-                new = xl_rowcol_to_cell(r-ROW_OFFSET, c)
-                old = xl_rowcol_to_cell(r-ROW_OFFSET, c-COL_OFFSET)
-                worksheet.write_formula(cell, '='+new+'/'+old+'-1')
-            
-            data_range = xl_rowcol_to_cell(r, 4) + ':' + xl_rowcol_to_cell(r, max_col)
-            worksheet.add_sparkline(r, 3, {'range': data_range, 
-                                           'type': 'column', 
-                                           'negative_points': True})      
-                           
-        
-        # RELIABILITY
-        worksheet.write(113, 1, 'Reliability', bold)    
-        
-        for r in range(114,117):
-            cell = xl_rowcol_to_cell(r, 2)
-            label = xl_rowcol_to_cell(r-ROW_OFFSET, 2)
-            worksheet.write_formula(cell, '='+label)
-            worksheet.set_row(r, None, percent_format) 
-            
-            for c in range(4+COL_OFFSET, max_col):
-                cell = xl_rowcol_to_cell(r, c)
-                new = xl_rowcol_to_cell(r-ROW_OFFSET, c)
-                old = xl_rowcol_to_cell(r-ROW_OFFSET, c-COL_OFFSET)
-                worksheet.write_formula(cell, '='+new+'/'+old+'-1')
-            
-            data_range = xl_rowcol_to_cell(r, 4) + ':' + xl_rowcol_to_cell(r, max_col)
-            worksheet.add_sparkline(r, 3, {'range': data_range, 
-                                           'type': 'column', 
-                                           'negative_points': True})      
-                        
+        worksheet.write(87,4, 'Percent Difference from 12 Months Before', self.bold)
+        worksheet.write(88,3, 'Percent Difference Trend', self.bold)
+        worksheet.write_row(88, 4, months['MONTH'].dt.to_pydatetime(), self.date_format)
         
-        # CROWDING
-        worksheet.write(117, 1, 'Crowding', bold)   
+        # the data, one row at a time, leaving out the observations
+        self.set_position(writer, worksheet, 89, 2)
         
-        for r in range(118,120):
-            cell = xl_rowcol_to_cell(r, 2)
-            label = xl_rowcol_to_cell(r-ROW_OFFSET, 2)
-            worksheet.write_formula(cell, '='+label)
-            worksheet.set_row(r, None, percent_format) 
-            
-            for c in range(4+COL_OFFSET, max_col):
-                cell = xl_rowcol_to_cell(r, c)
-                new = xl_rowcol_to_cell(r-ROW_OFFSET, c)
-                old = xl_rowcol_to_cell(r-ROW_OFFSET, c-COL_OFFSET)
-                worksheet.write_formula(cell, '='+new+'/'+old+'-1')
+        for header, rows in self.getSystemSections()[:-1]: 
+            worksheet.write(self.row, 1, header, self.bold)
+            self.row += 1
             
-            data_range = xl_rowcol_to_cell(r, 4) + ':' + xl_rowcol_to_cell(r, max_col)
-            worksheet.add_sparkline(r, 3, {'range': data_range, 
-                                           'type': 'column', 
-                                           'negative_points': True})      
+            for label, column, format in rows: 
+                worksheet.set_row(self.row, None, self.percent_format) 
+                worksheet.write_formula(cellName(self.row, 2), '='+cellName(self.row-ROW_OFFSET, 2))
+                
+                # blank where there is nothing to compare to
+                old = df[column].shift(COL_OFFSET)
+                pct = df[column] / old.where(old != 0) - 1
+                self.write_values(pct.values[COL_OFFSET:], col=4+COL_OFFSET)
                 
+                data_range = cellName(self.row, 4) + ':' + cellName(self.row, max_col)
+                worksheet.add_sparkline(self.row, 3, {'range': data_range, 
+                                                      'type': 'column', 
+                                                      'negative_points': True})      
+                self.row += 1
 
 
     def createRoutePlot(self, outfile, months, dow, tod, route_short_name, dir):
@@ -945,15 +804,82 @@ class TransitReporter():
         Creates a plot of route load/performance, and writes to the specified
         HTML file. 
         '''
+        self.createRoutePlots(outfile, months, [(dow, tod, route_short_name, dir)])
+        
+    
+    def createRoutePlots(self, outfile, months, plot_specs):
+        '''
+        Creates plots of route load/performance for each of a list of
+        (dow, tod, route_short_name, dir) specifications, and writes each
+        to its own HTML file.  The data for all the plots are read with 
+        one query per table, rather than one per plot. 
+        '''
         
         (month1, month2) = months
+        monthList = [pd.Timestamp(month1), pd.Timestamp(month2)]
+        
+        # the daily and time-of-day profiles are in different tables
+        tables = [('rs_day', [spec for spec in plot_specs if spec[1]=='Daily']), 
+                  ('rs_tod', [spec for spec in plot_specs if spec[1]!='Daily'])]
+        
+        # get the data for all the plots, reading only the columns used
+        keys = ['MONTH', 'DOW', 'TOD', 'ROUTE_SHORT_NAME', 'DIR']
+        groups = {}
+        with pd.HDFStore(self.ts_file, mode='r') as ts_store: 
+            for table, specs in tables: 
+                if len(specs)==0: 
+                    continue
+                
+                dows   = sorted(set([spec[0] for spec in specs]))
+                tods   = sorted(set([spec[1] for spec in specs]))
+                routes = sorted(set([spec[2] for spec in specs]))
+                dirs   = sorted(set([spec[3] for spec in specs]))
+                
+                columns = ['MONTH', 'DOW', 'ROUTE_SHORT_NAME', 'DIR', 
+                           'SEQ', 'STOPNAME', 'ON', 'OFF']
+                conditions = ['MONTH=monthList', 'DOW=dows', 
+                              'ROUTE_SHORT_NAME=routes', 'DIR=dirs']
+                
+                if table=='rs_day': 
+                    df = ts_store.select(table, where=conditions, columns=columns) 
+                    df['TOD'] = 'Daily'
+                else:
+                    df = ts_store.select(table, where=conditions + ['TOD=tods'], 
+                                         columns=columns + ['TOD'])  
+        
+                # re-calculate the load after averaging, for all the 
+                # routes at once. missing boardings or alightings don't 
+                # change the load
+                df['LOAD_DEP'] = ((df['ON'].fillna(0) - df['OFF'].fillna(0))
+                                  .groupby([df[key] for key in keys]).cumsum())
+                
+                for group, group_df in df.groupby(keys, sort=False): 
+                    groups[group] = group_df
+        
+        # and draw each plot
+        for dow, tod, route_short_name, dir in plot_specs: 
+            before = groups.get((monthList[0], dow, tod, route_short_name, dir))
+            after  = groups.get((monthList[1], dow, tod, route_short_name, dir))
+            self.drawRoutePlot(outfile, months, dow, tod, route_short_name, dir, 
+                               before, after)
+            
+    
+    def drawRoutePlot(self, outfile, months, dow, tod, route_short_name, dir, 
+                      before, after):
+        '''
+        Draws the route load plot from the stop-level data for the two 
+        months, and writes to an HTML file. 
+        '''
+        # bokeh is only needed for the plots, so import it here rather 
+        # than making the excel reports pay for it
+        import bokeh.plotting as bk
+        from bokeh.models.sources import ColumnDataSource
         
-        # format dates for printing
-        ctime1  = pd.Timestamp(month1).to_datetime().ctime()
-        ctime2  = pd.Timestamp(month2).to_datetime().ctime()        
+        (month1, month2) = months
         
-        cmonth1 = ctime1[4:7] + ' ' + ctime1[20:]
-        cmonth2 = ctime2[4:7] + ' ' + ctime2[20:]       
+        # format dates for printing, e.g. 'Jan 2014'
+        cmonth1 = pd.Timestamp(month1).strftime('%b %Y')
+        cmonth2 = pd.Timestamp(month2).strftime('%b %Y')
         
         # format title
         if (dir==1): 
@@ -979,34 +905,12 @@ class TransitReporter():
               + dow_string \
               + tod_string
         
-        # get the data
-        ts_store = pd.HDFStore(self.ts_file) 
-   
-        if tod=='Daily': 
-            before = ts_store.select('rs_day', where="MONTH=Timestamp(month1) & DOW=dow & ROUTE_SHORT_NAME=route_short_name & DIR=dir") 
-            after  = ts_store.select('rs_day', where="MONTH=Timestamp(month2) & DOW=dow & ROUTE_SHORT_NAME=route_short_name & DIR=dir") 
-        else:
-            before = ts_store.select('rs_tod', where="MONTH=Timestamp(month1) & DOW=dow & TOD=tod & ROUTE_SHORT_NAME=route_short_name & DIR=dir") 
-            after  = ts_store.select('rs_tod', where="MONTH=Timestamp(month2) & DOW=dow & TOD=tod & ROUTE_SHORT_NAME=route_short_name & DIR=dir")  
-        ts_store.close()
-
-        # re-calculate the load after averaging
-        load = 0.0
-        for i, row in before.iterrows():
-            if not np.isnan(row['OFF']): 
-                load -= row['OFF']
-            if not np.isnan(row['ON']): 
-                load += row['ON']
-            before.at[i, 'LOAD_DEP'] = load
-            
-        load = 0.0
-        for i, row in after.iterrows():
-            if not np.isnan(row['OFF']): 
-                load -= row['OFF']
-            if not np.isnan(row['ON']): 
-                load += row['ON']
-            after.at[i, 'LOAD_DEP'] = load
-            
+        # nothing to plot if either month is missing
+        if before is None or after is None: 
+            print('No data for route ' + str(route_short_name) + dir_string 
+                  + ' in ' + cmonth1 + ' and ' + cmonth2 + ', skipping plot.')
+            return
+
                                         
         #create the plot
         outfile = outfile+'_' + str(dir) + '_' + route_short_name + '_' +str(tod)+'.html'
@@ -1026,34 +930,48 @@ class TransitReporter():
         # plot the boardings and alightings as bar charts
         # y is the bottom of the rectangle, so adjust height accordingly
         
+        # put everything each month's glyphs need in a single source, 
+        # offsetting the bars so they sit side-by-side at each stop
+        src_before = ColumnDataSource(data=dict(
+               x_on  = (before['SEQ'] + 0.1).values, 
+               y_on  = (0.5 * before['ON']).values, 
+               h_on  = before['ON'].values, 
+               x_off = (before['SEQ'] - 0.4).values, 
+               y_off = (-0.5 * before['OFF']).values, 
+               h_off = before['OFF'].values, 
+               seq   = before['SEQ'].values, 
+               load  = before['LOAD_DEP'].values))
+               
+        src_after = ColumnDataSource(data=dict(
+               x_on  = (after['SEQ'] + 0.3).values, 
+               y_on  = (0.5 * after['ON']).values, 
+               h_on  = after['ON'].values, 
+               x_off = (after['SEQ'] - 0.2).values, 
+               y_off = (-0.5 * after['OFF']).values, 
+               h_off = after['OFF'].values, 
+               seq   = after['SEQ'].values, 
+               load  = after['LOAD_DEP'].values))
+        
         #before 
-        p.rect(x=before['SEQ']+0.1, 
-               y=0.5*before['ON'], 
-               width=0.2, 
-               height=before['ON'], 
+        p.rect(x='x_on', y='y_on', width=0.2, height='h_on', 
+               source=src_before, 
                color='steelblue', 
                legend=cmonth1 + ' Boardings')
                
-        p.rect(x=before['SEQ']-0.4, 
-               y=-0.5*before['OFF'], 
-               width=0.2, 
-               height=before['OFF'], 
+        p.rect(x='x_off', y='y_off', width=0.2, height='h_off', 
+               source=src_before, 
                color='steelblue', 
                alpha=0.4, 
                legend=cmonth1 + ' Alightings')
                
         #after
-        p.rect(x=after['SEQ']+0.3, 
-               y=0.5*after['ON'], 
-               width=0.2, 
-               height=after['ON'], 
+        p.rect(x='x_on', y='y_on', width=0.2, height='h_on', 
+               source=src_after, 
                color='crimson', 
                legend=cmonth2 + ' Boardings')
                
-        p.rect(x=after['SEQ']-0.2, 
-               y=-0.5*after['OFF'], 
-               width=0.2, 
-               height=after['OFF'], 
+        p.rect(x='x_off', y='y_off', width=0.2, height='h_off', 
+               source=src_after, 
                color='crimson', 
                alpha=0.4, 
                legend=cmonth2 + ' Alightings')
@@ -1063,15 +981,13 @@ class TransitReporter():
         # plot the load as a line
         
         # before
-        p.line(before['SEQ'], 
-               before['LOAD_DEP'], 
+        p.line('seq', 'load', source=src_before, 
                line_width=2, 
                line_color='steelblue', 
                legend=cmonth1 + ' Load')
                
         # after
-        p.line(after['SEQ'], 
-               after['LOAD_DEP'], 
+        p.line('seq', 'load', source=src_after, 
                line_width=2, 
                line_color='crimson', 
                legend=cmonth2 + ' Load')
@@ -1106,80 +1022,101 @@ class TransitReporter():
         '''
         Calculates the fields used in the  performance reports
         and stores them in an HDF datastore. 
+        
+        The result is kept for each county and shared by later calls, so 
+        it should not be modified. 
         '''   
+        if fips in self.demandData: 
+            return self.demandData[fips]
+        
         # open and join the input fields
-        demand_store = pd.HDFStore(self.demand_file)
-        multimodal_store = pd.HDFStore(self.multimodal_file)
-        
-        if fips=='Total': 
-            population = demand_store.select('totalPop')
-            acs        = demand_store.select('totalACS')
-            hu         = demand_store.select('countyHousingUnits', where="FIPS=fips")
-            employment = demand_store.select('totalEmp')
-            lodesWAC   = demand_store.select('lodesWACtotal')
-            lodesRAC   = demand_store.select('lodesRACtotal')
-            lodesOD    = demand_store.select('lodesODtotal')
-            autoOpCost = demand_store.select('autoOpCost')
-            tolls      = demand_store.select('tollCost')
-            parkingCost= demand_store.select('parkingCost')
-            transitFare= multimodal_store.select('transitFare')
-        else: 
-            population = demand_store.select('countyPop', where="FIPS=fips")
-            acs        = demand_store.select('countyACS', where="FIPS=fips")
-            hu         = demand_store.select('countyHousingUnits', where="FIPS=fips")
-            employment = demand_store.select('countyEmp', where="FIPS=fips")
-            lodesWAC   = demand_store.select('lodesWAC', where="FIPS=fips")
-            lodesRAC   = demand_store.select('lodesRAC', where="FIPS=fips")
-            lodesOD    = demand_store.select('lodesOD', where="FIPS=fips")
-            autoOpCost = demand_store.select('autoOpCost')
-            tolls      = demand_store.select('tollCost')
-            parkingCost= demand_store.select('parkingCost')
-            transitFare= multimodal_store.select('transitFare')
+        # tables without a filter are read whole, which skips the query
+        fipsWhere = "FIPS=fips"
+        
+        with pd.HDFStore(self.demand_file, mode='r') as demand_store: 
+            if fips=='Total': 
+                population = demand_store.get('totalPop')
+                acs        = demand_store.get('totalACS')
+                employment = demand_store.get('totalEmp')
+                lodesWAC   = demand_store.get('lodesWACtotal')
+                lodesRAC   = demand_store.get('lodesRACtotal')
+                lodesOD    = demand_store.get('lodesODtotal')
+            else: 
+                population = demand_store.select('countyPop', where=fipsWhere)
+                acs        = demand_store.select('countyACS', where=fipsWhere)
+                employment = demand_store.select('countyEmp', where=fipsWhere)
+                lodesWAC   = demand_store.select('lodesWAC', where=fipsWhere)
+                lodesRAC   = demand_store.select('lodesRAC', where=fipsWhere)
+                lodesOD    = demand_store.select('lodesOD', where=fipsWhere)
             
-        demand_store.close()
-        multimodal_store.close()
+            hu         = demand_store.select('countyHousingUnits', where=fipsWhere)
+        
+        (autoOpCost, tolls, parkingCost, transitFare) = self.getSharedCostTables()
         
         # start with the employment, which has the longest time-series, 
         # and join all the others with the month being equivalent
-        df = employment
-        df = pd.merge(df, population, how='left', on=['MONTH'], sort=True, suffixes=('', '_POP')) 
-        df = pd.merge(df, acs, how='left', on=['MONTH'], sort=True, suffixes=('', '_ACS')) 
-        df = pd.merge(df, hu, how='left', on=['MONTH'], sort=True, suffixes=('', '_HU')) 
-        df = pd.merge(df, lodesWAC, how='left', on=['MONTH'], sort=True, suffixes=('', '_WAC')) 
-        df = pd.merge(df, lodesRAC, how='left', on=['MONTH'], sort=True, suffixes=('', '_RAC')) 
-        df = pd.merge(df, lodesOD, how='left', on=['MONTH'], sort=True, suffixes=('', '_OD')) 
-        df = pd.merge(df, autoOpCost, how='left', on=['MONTH'], sort=True, suffixes=('', '_AOP')) 
-        df = pd.merge(df, tolls, how='left', on=['MONTH'], sort=True, suffixes=('', '_TOLL')) 
-        df = pd.merge(df, parkingCost, how='left', on=['MONTH'], sort=True, suffixes=('', '_PARK')) 
-        df = pd.merge(df, transitFare, how='left', on=['MONTH'], sort=True, suffixes=('', '_FARE')) 
-        
-        # some additional, calculated fields        
-        df['EMP_EARN0_40'] = df['EMP_EARN0_15'] + df['EMP_EARN15_40']
-        df['WORKERS_EARN0_40'] = df['WORKERS_EARN0_15'] + df['WORKERS_EARN15_40']
-        
-        df['EmpPerHU'] = 1.0 * df['TOTEMP'] / df['UNITS']
-        df['EmpPerWorker'] = 1.0 * df['TOTEMP'] / df['WORKERS_RAC']
-
-        df['INTRA_SHARE_EMP'] = df['INTRA'] / df['TOTEMP']
-        df['IN_SHARE_EMP'] = df['IN'] / df['TOTEMP']
-
-        df['INTRA_SHARE_WKR'] = df['INTRA'] / df['WORKERS_RAC']
-        df['OUT_SHARE_WKR'] = df['OUT'] / df['WORKERS_RAC']
-
-        df['WKR_SHARE_POP'] = df['WORKERS_RAC'] / df['POP']
-        
-        df['NON_WORKERS'] = df['POP'] - df['WORKERS_RAC']
-        
-        df['EMP_SHARE0_15']  = df['EMP_EARN0_15']  / df['TOTEMP']
-        df['EMP_SHARE15_40'] = df['EMP_EARN15_40'] / df['TOTEMP']
-        df['EMP_SHARE40P']   = df['EMP_EARN40P']   / df['TOTEMP']
-       
-        df['WORKERS_SHARE0_15']  = df['WORKERS_EARN0_15']  / df['WORKERS_RAC']
-        df['WORKERS_SHARE15_40'] = df['WORKERS_EARN15_40'] / df['WORKERS_RAC']
-        df['WORKERS_SHARE40P']   = df['WORKERS_EARN40P']   / df['WORKERS_RAC']
-
+        df = joinOnMonth(employment, [(population,  '_POP'), 
+                                      (acs,         '_ACS'), 
+                                      (hu,          '_HU'), 
+                                      (lodesWAC,    '_WAC'), 
+                                      (lodesRAC,    '_RAC'), 
+                                      (lodesOD,     '_OD'), 
+                                      (autoOpCost,  '_AOP'), 
+                                      (tolls,       '_TOLL'), 
+                                      (parkingCost, '_PARK'), 
+                                      (transitFare, '_FARE')])
+        
+        # some additional, calculated fields, evaluated together so the 
+        # input columns are only read once        
+        df.eval('''
+            EMP_EARN0_40 = EMP_EARN0_15 + EMP_EARN15_40
+            WORKERS_EARN0_40 = WORKERS_EARN0_15 + WORKERS_EARN15_40
+            
+            EmpPerHU = TOTEMP / UNITS
+            EmpPerWorker = TOTEMP / WORKERS_RAC
+            
+            INTRA_SHARE_EMP = INTRA / TOTEMP
+            IN_SHARE_EMP = IN / TOTEMP
+            
+            INTRA_SHARE_WKR = INTRA / WORKERS_RAC
+            OUT_SHARE_WKR = OUT / WORKERS_RAC
+            
+            WKR_SHARE_POP = WORKERS_RAC / POP
+            
+            NON_WORKERS = POP - WORKERS_RAC
+            
+            EMP_SHARE0_15  = EMP_EARN0_15  / TOTEMP
+            EMP_SHARE15_40 = EMP_EARN15_40 / TOTEMP
+            EMP_SHARE40P   = EMP_EARN40P   / TOTEMP
+            
+            WORKERS_SHARE0_15  = WORKERS_EARN0_15  / WORKERS_RAC
+            WORKERS_SHARE15_40 = WORKERS_EARN15_40 / WORKERS_RAC
+            WORKERS_SHARE40P   = WORKERS_EARN40P   / WORKERS_RAC
+            ''', inplace=True)
+
+        self.demandData[fips] = df
         return df
 
+
+    def getSharedCostTables(self):
+        '''
+        Returns the auto operating cost, toll, parking cost and transit 
+        fare tables.  These don't depend on the county, so they are read
+        once and re-used for each county in a report. 
+        '''
+        if self.sharedCostTables is None: 
+            with pd.HDFStore(self.demand_file, mode='r') as demand_store: 
+                autoOpCost = demand_store.get('autoOpCost')
+                tolls      = demand_store.get('tollCost')
+                parkingCost= demand_store.get('parkingCost')
+                
+            with pd.HDFStore(self.multimodal_file, mode='r') as multimodal_store: 
+                transitFare= multimodal_store.get('transitFare')
+                
+            self.sharedCostTables = (autoOpCost, tolls, parkingCost, transitFare)
+        
+        return self.sharedCostTables
+
         
     def writeDemandReport(self, xlsfile, fipsList, comments=None):
         '''
@@ -1189,34 +1126,48 @@ class TransitReporter():
         timestring = str(pd.Timestamp(datetime.datetime.now()))
         timestring = timestring.split('.')[0]
  
-        # establish the writer        
+        # establish the writer.  In constant memory mode, each row is 
+        # flushed to disk as soon as a later row is started, so every
+        # sheet below must be written strictly top to bottom.  
         self.writer = pd.ExcelWriter(xlsfile, engine='xlsxwriter',
-                        datetime_format='mmm-yyyy')        
+                        datetime_format='mmm-yyyy', 
+                        options={'constant_memory': True})        
+        
+        # the formats are shared by all the sheets
+        self.set_formats()
         
         fipsList.append(('Total', 'Total', 'Total'))
         
+        # read the county-independent tables once for all tabs
+        sharedCostTables = self.getSharedCostTables()
+        
+        # get the actual data, with the counties assembled in parallel. 
+        # each process opens its own file handles, and the excel writing
+        # stays in this process. 
+        files = (self.trip_file, self.ts_file, self.demand_file, 
+                 self.gtfs_file, self.multimodal_file, self.service_delivered_file)
+        tasks = [(files, sharedCostTables, fips) for fips, countyName, abbreviation in fipsList]
+        
+        pool = multiprocessing.Pool(min(len(tasks), multiprocessing.cpu_count()))
+        try: 
+            dfs = pool.map(assembleDemandDataInProcess, tasks)
+        finally: 
+            pool.close()
+            pool.join()
+        
         # create a tab for each county
-        for fips, countyName, abbreviation in fipsList: 
-    
-            # get the actual data
-            df = self.assembleDemandData(fips)    
-                        
-            # Write the month as the column headers
+        for (fips, countyName, abbreviation), df in zip(fipsList, dfs): 
+            self.demandData[fips] = df
             months = df[['MONTH']]
-            months.T.to_excel(self.writer, sheet_name=countyName,  
-                                    startrow=10, startcol=7, header=False, index=False)
                         
-        
-            # note that we have to call the pandas function first to get the
-            # excel sheet created properly, so now we can access that
-            worksheet = self.writer.sheets[countyName]
-                
-            # set up the formatting, with defaults
-            bold = self.writer.book.add_format({'bold': 1})        
+            # create the sheet directly, so the header rows can be 
+            # written before any of the data
+            worksheet = self.writer.book.add_worksheet(countyName)
+            self.writer.sheets[countyName] = worksheet
                 
             # set the column widths
             worksheet.set_column(0, 0, 1)
-            worksheet.set_column(1, 1, 3, bold)
+            worksheet.set_column(1, 1, 3, self.bold)
             worksheet.set_column(2, 2, 45)
             worksheet.set_column(3, 3, 17)
             worksheet.set_column(4, 4, 15)
@@ -1224,8 +1175,8 @@ class TransitReporter():
             worksheet.set_column(6, 6, 25)                    
                 
             # write the header
-            worksheet.write(1, 1, 'Drivers of Demand Report', bold)
-            worksheet.write(3, 1, 'Input Specification', bold)
+            worksheet.write(1, 1, 'Drivers of Demand Report', self.bold)
+            worksheet.write(3, 1, 'Input Specification', self.bold)
             worksheet.write(4, 2, 'Geographic Extent: ')
             worksheet.write(4, 3, countyName)
             worksheet.write(5, 2, 'Temporal Resolution: ')
@@ -1254,165 +1205,87 @@ class TransitReporter():
         # get the worksheet
         worksheet = self.writer.sheets[sheetName]        
         
-        # set up the formatting, with defaults
-        bold = self.writer.book.add_format({'bold': 1})
-        int_format = self.writer.book.add_format({'num_format': '#,##0'})
-        dec_format = self.writer.book.add_format({'num_format': '#,##0.00'})
-        cent_format = self.writer.book.add_format({'num_format': '$#,##0.00'})
-        dollar_format = self.writer.book.add_format({'num_format': '$#,##0'})
-        percent_format = self.writer.book.add_format({'num_format': '0.0%'})
-        
         # HEADER
-        worksheet.write(9, 7, 'Values', bold)
-        worksheet.write(10, 3, 'Source', bold)        
-        worksheet.write(10, 4, 'Temporal Res', bold)        
-        worksheet.write(10, 5, 'Geog Res', bold)        
-        worksheet.write(10, 6, 'Trend', bold)        
+        worksheet.write(9, 7, 'Values', self.bold)
+        worksheet.write(10, 3, 'Source', self.bold)        
+        worksheet.write(10, 4, 'Temporal Res', self.bold)        
+        worksheet.write(10, 5, 'Geog Res', self.bold)        
+        worksheet.write(10, 6, 'Trend', self.bold)        
+        self.write_months(worksheet, 10, 7, months)
         
         self.set_position(self.writer, worksheet, 11, 2)
         
-        # POPULATION & HOUSEHOLDS
-        worksheet.write(self.row, 1, 'Population & Households', bold)
-        self.row += 1
-        
-        self.write_row(label='Population', data=df[['POP']], 
-            source='Census PopEst', tempRes='Annual', geogRes='County', format=int_format)
-
-        self.write_row(label='Households', data=df[['HH']], 
-            source='ACS', tempRes='Annual', geogRes='County', format=int_format)
-
-        self.write_row(label='Housing Units', data=df[['UNITS_ACS']], 
-            source='ACS', tempRes='Annual', geogRes='County', format=int_format)
-
-        self.write_row(label='Housing Units', data=df[['UNITS']], 
-            source='Planning Dept/Census', tempRes='Date', geogRes='Block', format=int_format)
-
-        self.write_row(label='Households, Income $0-15k', data=df[['HH_INC0_15']], 
-            source='ACS', tempRes='Annual', geogRes='County', format=int_format)
-
-        self.write_row(label='Households, Income $15-50k', data=df[['HH_INC15_50']], 
-            source='ACS', tempRes='Annual', geogRes='County', format=int_format)
-
-        self.write_row(label='Households, Income $50-100k', data=df[['HH_INC50_100']], 
-            source='ACS', tempRes='Annual', geogRes='County', format=int_format)
-
-        self.write_row(label='Households, Income $100k+', data=df[['HH_INC100P']], 
-            source='ACS', tempRes='Annual', geogRes='County', format=int_format)
-
-        self.write_row(label='Households, 0 Vehicles', data=df[['HH_0VEH']], 
-            source='ACS', tempRes='Annual', geogRes='County', format=int_format)
-        
-        self.write_row(label='Median Household Income (2010$)', data=df[['MEDIAN_HHINC_2010USD']], 
-            source='ACS', tempRes='Annual', geogRes='County', format=dollar_format)
-            
-            
-        # POPULATION & HOUSEHOLDS
-        worksheet.write(self.row, 1, 'Workers (at home location)', bold)
-        self.row += 1
-        
-        self.write_row(label='Workers', data=df[['WORKERS_RAC']], 
-            source='LODES RAC/QCEW', tempRes='Annual/Monthly', geogRes='Block', format=int_format)
-            
-        self.write_row(label='Workers, earning $0-15k', data=df[['WORKERS_EARN0_15']], 
-            source='LODES RAC/QCEW', tempRes='Annual/Monthly', geogRes='Block', format=int_format)
-
-        self.write_row(label='Workers, earning $15-40k', data=df[['WORKERS_EARN15_40']], 
-            source='LODES RAC/QCEW', tempRes='Annual/Monthly', geogRes='Block', format=int_format)
-            
-        self.write_row(label='Workers, earning $40k+', data=df[['WORKERS_EARN40P']], 
-            source='LODES RAC/QCEW', tempRes='Annual/Monthly', geogRes='Block', format=int_format)
-        
-            
-        # EMPLOYMENT
-        worksheet.write(self.row, 1, 'Employment (at work location)', bold)
-        self.row += 1
-        
-        self.write_row(label='Total Employment', data=df[['TOTEMP']], 
-            source='LODES WAC/QCEW', tempRes='Monthly', geogRes='Block', format=int_format)
-            
-        self.write_row(label='Retail Employment', data=df[['RETAIL_EMP']], 
-            source='LODES WAC/QCEW', tempRes='Monthly', geogRes='Block', format=int_format)
-            
-        self.write_row(label='Education and Health Employment', data=df[['EDHEALTH_EMP']], 
-            source='LODES WAC/QCEW', tempRes='Monthly', geogRes='Block', format=int_format)
-            
-        self.write_row(label='Leisure Employment', data=df[['LEISURE_EMP']], 
-            source='LODES WAC/QCEW', tempRes='Monthly', geogRes='Block', format=int_format)
-            
-        self.write_row(label='Other Employment', data=df[['OTHER_EMP']], 
-            source='LODES WAC/QCEW', tempRes='Monthly', geogRes='Block', format=int_format)
-            
-        self.write_row(label='Employees, earning $0-15k', data=df[['EMP_EARN0_15']], 
-            source='LODES WAC/QCEW', tempRes='Monthly', geogRes='Block', format=int_format)
-            
-        self.write_row(label='Employees, earning $15-40k', data=df[['EMP_EARN15_40']], 
-            source='LODES WAC/QCEW', tempRes='Monthly', geogRes='Block', format=int_format)
-            
-        self.write_row(label='Employees, earning $40k+', data=df[['EMP_EARN40P']], 
-            source='LODES WAC/QCEW', tempRes='Monthly', geogRes='Block', format=int_format)
-            
-        self.write_row(label='Average monthly earnings (2010$)', data=df[['AVG_MONTHLY_EARNINGS_2010USD']], 
-            source='QCEW', tempRes='Monthly', geogRes='County', format=dollar_format)
-
-        # JOBS-HOUSING BALANCE
-        worksheet.write(self.row, 1, 'Jobs-Housing Balance', bold)
-        self.row += 1
-        
-        self.write_row(label='Employees per Housing Unit', data=df[['EmpPerHU']], 
-            source='QCEW/Planning Dept', tempRes='Monthly', geogRes='Block', format=dec_format)
-
-        self.write_row(label='Employees per Worker', data=df[['EmpPerWorker']], 
-            source='LODES OD/QCEW', tempRes='Annual/Monthly', geogRes='Block', format=dec_format)
-
-        self.write_row(label='Workers: Live & Work in SF', data=df[['INTRA']], 
-            source='LODES OD/QCEW', tempRes='Annual/Monthly', geogRes='Block', format=int_format)
-
-        self.write_row(label='Workers: Live elswhere & work in SF', data=df[['IN']], 
-            source='LODES OD/QCEW', tempRes='Annual/Monthly', geogRes='Block', format=int_format)
-            
-        self.write_row(label='Workers: Live in SF & work elsewhere', data=df[['OUT']], 
-            source='LODES OD/QCEW', tempRes='Annual/Monthly', geogRes='Block', format=int_format)
-            
-        # COSTS
-        worksheet.write(self.row, 1, 'Costs', bold)
-        self.row += 1
-        
-        self.write_row(label='Average Fuel Price (2010$)', data=df[['FUEL_PRICE_2010USD']], 
-            source='EIA', tempRes='Monthly', geogRes='MSA', format=cent_format)
-            
-        self.write_row(label='Average Fleet Efficiency (mpg)', data=df[['FLEET_EFFICIENCY']], 
-            source='BTS', tempRes='Annual', geogRes='US', format=dec_format)
-            
-        self.write_row(label='Average Fuel Cost (2010$ / mi)', data=df[['FUEL_COST_2010USD']], 
-            source='BTS/EIA', tempRes='Annual/Monthly', geogRes='US/MSA', format=cent_format)
-
-        self.write_row(label='Average Auto Operating Cost (2010$/mile)', data=df[['IRS_MILEAGE_RATE_2010USD']], 
-            source='IRS', tempRes='Annual', geogRes='US', format=cent_format)
-            
-        self.write_row(label='Median Daily CBD Parking Cost (2010$)', data=df[['DAILY_PARKING_RATE_2010USD']], 
-            source='Colliers', tempRes='Annual', geogRes='CBD', format=cent_format)
-            
-        self.write_row(label='Median Monthly CBD Parking Cost (2010$)', data=df[['MONTHLY_PARKING_RATE_2010USD']], 
-            source='Colliers', tempRes='Annual', geogRes='CBD', format=cent_format)
-
-        self.write_row(label='Bay Bridge Toll, Peak (2010$)', data=df[['TOLL_BB_PK_2010USD']], 
-            source='BATA', tempRes='Monthly', geogRes='Bridge', format=cent_format)
-            
-        self.write_row(label='Bay Bridge Toll, Off-Peak (2010$)', data=df[['TOLL_BB_OP_2010USD']], 
-            source='BATA', tempRes='Monthly', geogRes='Bridge', format=cent_format)
-
-        self.write_row(label='Bay Bridge Toll, Carpools (2010$)', data=df[['TOLL_BB_CARPOOL_2010USD']], 
-            source='BATA', tempRes='Monthly', geogRes='Bridge', format=cent_format)
-
-        self.write_row(label='Golden Gate Bridge Toll, Peak (2010$)', data=df[['TOLL_GGB_2010USD']], 
-            source='BATA', tempRes='Monthly', geogRes='Bridge', format=cent_format)
-
-        self.write_row(label='Golden Gate Bridge Toll, Carpools (2010$)', data=df[['TOLL_GGB_CARPOOL_2010USD']], 
-            source='BATA', tempRes='Monthly', geogRes='Bridge', format=cent_format)
-
-        self.write_row(label='Consumer Price Index', data=df[['CPI']], 
-            source='BLS', tempRes='Monthly', geogRes='US City Avg', format=int_format)
-            
+        # each section has a header followed by rows of 
+        # (label, column, source, temporal res, geographic res, format)
+        sections = [
+            ('Population & Households', [
+                ('Population', 'POP', 'Census PopEst', 'Annual', 'County', self.int_format),
+                ('Households', 'HH', 'ACS', 'Annual', 'County', self.int_format),
+                ('Housing Units', 'UNITS_ACS', 'ACS', 'Annual', 'County', self.int_format),
+                ('Housing Units', 'UNITS', 'Planning Dept/Census', 'Date', 'Block', self.int_format),
+                ('Households, Income $0-15k', 'HH_INC0_15', 'ACS', 'Annual', 'County', self.int_format),
+                ('Households, Income $15-50k', 'HH_INC15_50', 'ACS', 'Annual', 'County', self.int_format),
+                ('Households, Income $50-100k', 'HH_INC50_100', 'ACS', 'Annual', 'County', self.int_format),
+                ('Households, Income $100k+', 'HH_INC100P', 'ACS', 'Annual', 'County', self.int_format),
+                ('Households, 0 Vehicles', 'HH_0VEH', 'ACS', 'Annual', 'County', self.int_format),
+                ('Median Household Income (2010$)', 'MEDIAN_HHINC_2010USD', 'ACS', 'Annual', 'County', self.dollar_format),
+                ]),
+            ('Workers (at home location)', [
+                ('Workers', 'WORKERS_RAC', 'LODES RAC/QCEW', 'Annual/Monthly', 'Block', self.int_format),
+                ('Workers, earning $0-15k', 'WORKERS_EARN0_15', 'LODES RAC/QCEW', 'Annual/Monthly', 'Block', self.int_format),
+                ('Workers, earning $15-40k', 'WORKERS_EARN15_40', 'LODES RAC/QCEW', 'Annual/Monthly', 'Block', self.int_format),
+                ('Workers, earning $40k+', 'WORKERS_EARN40P', 'LODES RAC/QCEW', 'Annual/Monthly', 'Block', self.int_format),
+                ]),
+            ('Employment (at work location)', [
+                ('Total Employment', 'TOTEMP', 'LODES WAC/QCEW', 'Monthly', 'Block', self.int_format),
+                ('Retail Employment', 'RETAIL_EMP', 'LODES WAC/QCEW', 'Monthly', 'Block', self.int_format),
+                ('Education and Health Employment', 'EDHEALTH_EMP', 'LODES WAC/QCEW', 'Monthly', 'Block', self.int_format),
+                ('Leisure Employment', 'LEISURE_EMP', 'LODES WAC/QCEW', 'Monthly', 'Block', self.int_format),
+                ('Other Employment', 'OTHER_EMP', 'LODES WAC/QCEW', 'Monthly', 'Block', self.int_format),
+                ('Employees, earning $0-15k', 'EMP_EARN0_15', 'LODES WAC/QCEW', 'Monthly', 'Block', self.int_format),
+                ('Employees, earning $15-40k', 'EMP_EARN15_40', 'LODES WAC/QCEW', 'Monthly', 'Block', self.int_format),
+                ('Employees, earning $40k+', 'EMP_EARN40P', 'LODES WAC/QCEW', 'Monthly', 'Block', self.int_format),
+                ('Average monthly earnings (2010$)', 'AVG_MONTHLY_EARNINGS_2010USD', 'QCEW', 'Monthly', 'County', self.dollar_format),
+                ]),
+            ('Jobs-Housing Balance', [
+                ('Employees per Housing Unit', 'EmpPerHU', 'QCEW/Planning Dept', 'Monthly', 'Block', self.dec_format),
+                ('Employees per Worker', 'EmpPerWorker', 'LODES OD/QCEW', 'Annual/Monthly', 'Block', self.dec_format),
+                ('Workers: Live & Work in SF', 'INTRA', 'LODES OD/QCEW', 'Annual/Monthly', 'Block', self.int_format),
+                ('Workers: Live elswhere & work in SF', 'IN', 'LODES OD/QCEW', 'Annual/Monthly', 'Block', self.int_format),
+                ('Workers: Live in SF & work elsewhere', 'OUT', 'LODES OD/QCEW', 'Annual/Monthly', 'Block', self.int_format),
+                ]),
+            ('Costs', [
+                ('Average Fuel Price (2010$)', 'FUEL_PRICE_2010USD', 'EIA', 'Monthly', 'MSA', self.cent_format),
+                ('Average Fleet Efficiency (mpg)', 'FLEET_EFFICIENCY', 'BTS', 'Annual', 'US', self.dec_format),
+                ('Average Fuel Cost (2010$ / mi)', 'FUEL_COST_2010USD', 'BTS/EIA', 'Annual/Monthly', 'US/MSA', self.cent_format),
+                ('Average Auto Operating Cost (2010$/mile)', 'IRS_MILEAGE_RATE_2010USD', 'IRS', 'Annual', 'US', self.cent_format),
+                ('Median Daily CBD Parking Cost (2010$)', 'DAILY_PARKING_RATE_2010USD', 'Colliers', 'Annual', 'CBD', self.cent_format),
+                ('Median Monthly CBD Parking Cost (2010$)', 'MONTHLY_PARKING_RATE_2010USD', 'Colliers', 'Annual', 'CBD', self.cent_format),
+                ('Bay Bridge Toll, Peak (2010$)', 'TOLL_BB_PK_2010USD', 'BATA', 'Monthly', 'Bridge', self.cent_format),
+                ('Bay Bridge Toll, Off-Peak (2010$)', 'TOLL_BB_OP_2010USD', 'BATA', 'Monthly', 'Bridge', self.cent_format),
+                ('Bay Bridge Toll, Carpools (2010$)', 'TOLL_BB_CARPOOL_2010USD', 'BATA', 'Monthly', 'Bridge', self.cent_format),
+                ('Golden Gate Bridge Toll, Peak (2010$)', 'TOLL_GGB_2010USD', 'BATA', 'Monthly', 'Bridge', self.cent_format),
+                ('Golden Gate Bridge Toll, Carpools (2010$)', 'TOLL_GGB_CARPOOL_2010USD', 'BATA', 'Monthly', 'Bridge', self.cent_format),
+                ('Consumer Price Index', 'CPI', 'BLS', 'Monthly', 'US City Avg', self.int_format),
+                ]),
+            ]
+        
+        for header, rows in sections: 
+            worksheet.write(self.row, 1, header, self.bold)
+            self.row += 1
+            
+            # the row format has to be set before the row's cells are written
+            for label, column, source, tempRes, geogRes, format in rows: 
+                worksheet.set_row(self.row, None, format) 
+                self.write_labels(label, source, tempRes, geogRes)
+                self.write_values(df[column].values)
+                
+                cell = xl_rowcol_to_cell(self.row, self.col+4)
+                data_range = (xl_rowcol_to_cell(self.row, self.col+5) + 
+                       ':' + xl_rowcol_to_cell(self.row, self.col+5+len(df)+1))
+                worksheet.add_sparkline(cell, {'range': data_range})   
+                self.row += 1
+            
 
 
     def writeDemandDifferenceFormulas(self, months, sheetName): 
@@ -1425,73 +1298,62 @@ class TransitReporter():
         COL_OFFSET = 12
         max_col = 6+len(months)+1
         
+        # the (new, old) column pairs are the same for every row
+        col_pairs = [(c, c-COL_OFFSET) for c in range(7+COL_OFFSET, max_col)]
+        
+        # formula templates, filled in with the source cell names
+        LABEL_TEMPLATE = '=IF(ISTEXT({0}),{0},"")'
+        DIFF_TEMPLATE = '=IF(AND(ISNUMBER({o}),ISNUMBER({n})),{n}-{o},"")'
+        
         # get the worksheet
-        workbook  = self.writer.book
         worksheet = self.writer.sheets[sheetName]        
         
-        # set up the formatting, with defaults
-        bold = workbook.add_format({'bold': 1})
-        int_format = workbook.add_format({'num_format': '#,##0'})
-        dec_format = workbook.add_format({'num_format': '#,##0.00'})
-        money_format = workbook.add_format({'num_format': '$#,##0.00'})
-        percent_format = workbook.add_format({'num_format': '0.0%'})
-        
         # the header and labels
-        worksheet.write(58, 7, 'Difference from 12 Months Before', bold)
-        worksheet.write(59, 3, 'Source', bold)        
-        worksheet.write(59, 4, 'Temporal Res', bold)        
-        worksheet.write(59, 5, 'Geog Res', bold)    
-        worksheet.write(59, 6, 'Difference Trend', bold)
-        months.T.to_excel(self.writer, sheet_name=sheetName, 
-                            startrow=59, startcol=7, header=False, index=False)   
-        
-        # the data: 
+        worksheet.write(58, 7, 'Difference from 12 Months Before', self.bold)
+        worksheet.write(59, 3, 'Source', self.bold)        
+        worksheet.write(59, 4, 'Temporal Res', self.bold)        
+        worksheet.write(59, 5, 'Geog Res', self.bold)    
+        worksheet.write(59, 6, 'Difference Trend', self.bold)
+        self.write_months(worksheet, 59, 7, months)
+        
+        # the section headers, and the number format of each data row
+        headers = {60: 'Population & Households', 
+                   71: 'Workers (at home location)', 
+                   76: 'Employment (at work location)', 
+                   86: 'Jobs-Housing Balance', 
+                   92: 'Costs'}
+        
+        formats = {}
+        for r in list(range(61,71)) + list(range(72,76)) + list(range(77,86)) + list(range(89,92)):
+            formats[r] = self.int_format
+        for r in range(87,89):
+            formats[r] = self.dec_format
+        for r in range(93,106):
+            formats[r] = self.cent_format
+        
+        # the data, one row at a time: 
         for r in range(60,106):
-            for c in range(2, 6): 
-                cell = xl_rowcol_to_cell(r, c)
-                label = xl_rowcol_to_cell(r-ROW_OFFSET, c)
-                worksheet.write_formula(cell, '=IF(ISTEXT('+label+'),'+label+',"")')
+            # cell names in the source row, shared by the new and old values
+            src = [cellName(r-ROW_OFFSET, c) for c in range(max_col)]
+            
+            labels = [LABEL_TEMPLATE.format(src[c]) for c in range(2, 6)]
+            if r in headers: 
+                worksheet.write(r, 1, headers[r], self.bold)
+                worksheet.write_blank(r, 2, None, self.bold)
+                worksheet.write_row(r, 3, labels[1:])
+            else: 
+                worksheet.set_row(r, None, formats[r]) 
+                worksheet.write_row(r, 2, labels)
             
-            for c in range(7+COL_OFFSET, max_col):
-                cell = xl_rowcol_to_cell(r, c)
-                new = xl_rowcol_to_cell(r-ROW_OFFSET, c)
-                old = xl_rowcol_to_cell(r-ROW_OFFSET, c-COL_OFFSET)
-                worksheet.write_formula(cell, '=IF(AND(ISNUMBER('+old+'),ISNUMBER('+new+')),'+new+'-'+old+',"")')
+            formulas = [DIFF_TEMPLATE.format(n=src[new_c], o=src[old_c]) 
+                        for new_c, old_c in col_pairs]
+            worksheet.write_row(r, 7+COL_OFFSET, formulas)
             
-            data_range = xl_rowcol_to_cell(r, 7) + ':' + xl_rowcol_to_cell(r, max_col)
+            data_range = cellName(r, 7) + ':' + cellName(r, max_col)
             worksheet.add_sparkline(r, 6, {'range': data_range, 
                                            'type': 'column', 
                                            'negative_points': True})                  
                
-               
-        # set the headers and formats                    
-        worksheet.write(60,  1, 'Population & Households', bold)
-        worksheet.write_blank(60,  2, None, bold)
-        for r in range(61,71):                     
-            worksheet.set_row(r, None, int_format) 
-
-        worksheet.write(71,  1, 'Workers (at home location)', bold)
-        worksheet.write_blank(71,  2, None, bold)
-        for r in range(72,76):                     
-            worksheet.set_row(r, None, int_format) 
-
-        worksheet.write(76, 1, 'Employment (at work location)', bold)
-        worksheet.write_blank(76,  2, None, bold)
-        for r in range(77,86):                     
-            worksheet.set_row(r, None, int_format) 
-
-        worksheet.write(86, 1, 'Jobs-Housing Balance', bold)
-        worksheet.write_blank(86,  2, None, bold)
-        for r in range(87,89):                     
-            worksheet.set_row(r, None, dec_format) 
-        for r in range(89,92):                     
-            worksheet.set_row(r, None, int_format) 
-
-        worksheet.write(92, 1, 'Costs', bold)
-        worksheet.write_blank(92,  2, None, bold)
-        for r in range(93,106):                     
-            worksheet.set_row(r, None, money_format) 
-
 
 
     def writeDemandPercentDifferenceFormulas(self, months, sheetName): 
@@ -1504,61 +1366,54 @@ class TransitReporter():
         COL_OFFSET = 12
         max_col = 6+len(months)+1
         
+        # the (new, old) column pairs are the same for every row
+        col_pairs = [(c, c-COL_OFFSET) for c in range(7+COL_OFFSET, max_col)]
+        
+        # formula templates, filled in with the source cell names
+        LABEL_TEMPLATE = '=IF(ISTEXT({0}),{0},"")'
+        PCT_DIFF_TEMPLATE = '=IF(AND(ISNUMBER({o}),ISNUMBER({n})),{n}/{o}-1,"")'
+        
         # get the worksheet
-        workbook  = self.writer.book
         worksheet = self.writer.sheets[sheetName]        
         
-        # set up the formatting, with defaults
-        bold = workbook.add_format({'bold': 1})
-        int_format = workbook.add_format({'num_format': '#,##0'})
-        dec_format = workbook.add_format({'num_format': '#,##0.00'})
-        money_format = workbook.add_format({'num_format': '$#,##0.00'})
-        percent_format = workbook.add_format({'num_format': '0.0%'})
-        
         # the header and labels
-        worksheet.write(107, 7, 'Percent Difference from 12 Months Before', bold)
-        worksheet.write(108, 3, 'Source', bold)        
-        worksheet.write(108, 4, 'Temporal Res', bold)        
-        worksheet.write(108, 5, 'Geog Res', bold)    
-        worksheet.write(108, 6, 'Percent Difference Trend', bold)
-        months.T.to_excel(self.writer, sheet_name=sheetName, 
-                            startrow=108, startcol=7, header=False, index=False)   
-        
-        # the data
+        worksheet.write(107, 7, 'Percent Difference from 12 Months Before', self.bold)
+        worksheet.write(108, 3, 'Source', self.bold)        
+        worksheet.write(108, 4, 'Temporal Res', self.bold)        
+        worksheet.write(108, 5, 'Geog Res', self.bold)    
+        worksheet.write(108, 6, 'Percent Difference Trend', self.bold)
+        self.write_months(worksheet, 108, 7, months)
+        
+        # the section headers
+        headers = {109: 'Population & Households', 
+                   120: 'Workers (at home location)', 
+                   125: 'Employment (at work location)', 
+                   135: 'Jobs-Housing Balance', 
+                   141: 'Costs'}
+        
+        # the data, one row at a time
         for r in range(109,155):
-            for c in range(2, 6): 
-                cell = xl_rowcol_to_cell(r, c)
-                label = xl_rowcol_to_cell(r-ROW_OFFSET, c)
-                worksheet.write_formula(cell, '=IF(ISTEXT('+label+'),'+label+',"")')
+            # cell names in the source row, shared by the new and old values
+            src = [cellName(r-ROW_OFFSET, c) for c in range(max_col)]
             
-            worksheet.set_row(r, None, percent_format) 
+            worksheet.set_row(r, None, self.percent_format) 
+            
+            labels = [LABEL_TEMPLATE.format(src[c]) for c in range(2, 6)]
+            if r in headers: 
+                worksheet.write(r, 1, headers[r], self.bold)
+                worksheet.write_blank(r, 2, None, self.bold)
+                worksheet.write_row(r, 3, labels[1:])
+            else: 
+                worksheet.write_row(r, 2, labels)
 
-            for c in range(7+COL_OFFSET, max_col):
-                cell = xl_rowcol_to_cell(r, c)
-                new = xl_rowcol_to_cell(r-ROW_OFFSET, c)
-                old = xl_rowcol_to_cell(r-ROW_OFFSET, c-COL_OFFSET)
-                worksheet.write_formula(cell, '=IF(AND(ISNUMBER('+old+'),ISNUMBER('+new+')),'+new+'/'+old+'-1,"")')
+            formulas = [PCT_DIFF_TEMPLATE.format(n=src[new_c], o=src[old_c]) 
+                        for new_c, old_c in col_pairs]
+            worksheet.write_row(r, 7+COL_OFFSET, formulas)
             
-            data_range = xl_rowcol_to_cell(r, 7) + ':' + xl_rowcol_to_cell(r, max_col)
+            data_range = cellName(r, 7) + ':' + cellName(r, max_col)
             worksheet.add_sparkline(r, 6, {'range': data_range, 
                                            'type': 'column', 
                                            'negative_points': True})                  
-               
-        # set the headers and formats                    
-        worksheet.write(109,  1, 'Population & Households', bold)
-        worksheet.write_blank(109,  2, None, bold)
-
-        worksheet.write(120,  1, 'Workers (at home location)', bold)
-        worksheet.write_blank(120,  2, None, bold)
-
-        worksheet.write(125, 1, 'Employment (at work location)', bold)
-        worksheet.write_blank(125,  2, None, bold)
-
-        worksheet.write(135, 1, 'Jobs-Housing Balance', bold)
-        worksheet.write_blank(135,  2, None, bold)
-
-        worksheet.write(141, 1, 'Costs', bold)
-        worksheet.write_blank(141,  2, None, bold)
 
         
 
@@ -1569,93 +1424,108 @@ class TransitReporter():
         and stores them in an HDF datastore. 
         '''   
         # open and join the input fields
-        mm_store = pd.HDFStore(self.multimodal_file)
-        demand_store = pd.HDFStore(self.demand_file)
-        trip_store = pd.HDFStore(self.trip_file)
+        with pd.HDFStore(self.multimodal_file, mode='r') as mm_store: 
+            transit = mm_store.select('transitAnnual')
+            fares = mm_store.select('transitFareAnnual')
+            bart = mm_store.select('bart_weekday', where="FROM='Entries' and TO='Exits'")
+            
+        with pd.HDFStore(self.demand_file, mode='r') as demand_store: 
+            acs = demand_store.select('countyACSannual', where="FIPS=fips")
         
-        transit = mm_store.select('transitAnnual')
-        fares = mm_store.select('transitFareAnnual')
-        acs = demand_store.select('countyACSannual', where="FIPS=fips")
+        with pd.HDFStore(self.trip_file, mode='r') as trip_store: 
+            trips = trip_store.select('system_day', where='DOW=1') 
         
         # get and aggregate monthly bordings        
-        trips = trip_store.select('system_day', where='DOW=1') 
         muni = trips[['MONTH']].copy()
         muni['APC_ON_MUNI_BUS'] = trips['ON']
-        muni['FISCAL_YEAR'] = muni['MONTH'].apply(lambda x: (x + pd.DateOffset(months=6)).year)
+        muni['FISCAL_YEAR'] = muni['MONTH'].dt.year + (muni['MONTH'].dt.month >= 7)
         muni_annual = muni.groupby('FISCAL_YEAR').agg('mean').reset_index()
         
-        bart = mm_store.select('bart_weekday', where="FROM='Entries' and TO='Exits'")
         bart['APC_ON_BART'] = bart['RIDERS']
-        bart['FISCAL_YEAR'] = bart['MONTH'].apply(lambda x: (x + pd.DateOffset(months=6)).year)
+        bart['FISCAL_YEAR'] = bart['MONTH'].dt.year + (bart['MONTH'].dt.month >= 7)
         bart_annual = bart.groupby('FISCAL_YEAR').agg('mean').reset_index()
-        
-        # close files
-        mm_store.close()
-        demand_store.close()
-        trip_store.close()
 
         # start with the population, which has the longest time-series, 
         # and join all the others with the month being equivalent
-        df = pd.merge(transit, fares, how='left', on=['FISCAL_YEAR'],  sort=True, suffixes=('', '_FARE')) 
-        df = pd.merge(df, acs, how='left', left_on=['FISCAL_YEAR'], right_on=['YEAR'], sort=True, suffixes=('', '_ACS')) 
-        df = pd.merge(df, muni_annual, how='outer', left_on=['FISCAL_YEAR'], right_on=['FISCAL_YEAR'], sort=True, suffixes=('', '_APC')) 
-        df = pd.merge(df, bart_annual, how='outer', left_on=['FISCAL_YEAR'], right_on=['FISCAL_YEAR'], sort=True, suffixes=('', '_APC')) 
+        df = pd.merge(transit, fares, how='left', on=['FISCAL_YEAR'], suffixes=('', '_FARE')) 
+        df = pd.merge(df, acs, how='left', left_on=['FISCAL_YEAR'], right_on=['YEAR'], suffixes=('', '_ACS')) 
+        df = pd.merge(df, muni_annual, how='outer', left_on=['FISCAL_YEAR'], right_on=['FISCAL_YEAR'], suffixes=('', '_APC')) 
+        df = pd.merge(df, bart_annual, how='outer', left_on=['FISCAL_YEAR'], right_on=['FISCAL_YEAR'], suffixes=('', '_APC')) 
+
+        # sort once, rather than in every merge
+        df = df.sort_values('FISCAL_YEAR', kind='mergesort').reset_index(drop=True)
 
         return df
 
 
-    def assembleMonthlyMultiModalData(self, fips):
+    def assembleMonthlyMultiModalData(self, fips, gtfsColumns=None):
         '''
         Calculates the fields used in the system performance reports
         and stores them in an HDF datastore. 
+        
+        gtfsColumns - the columns to read from the GTFS schedule tables, 
+                      or None to read them all
+        
+        The result is kept and shared by later calls with the same 
+        arguments, so it should not be modified. 
         '''   
+        key = (fips, None if gtfsColumns is None else tuple(gtfsColumns))
+        if key in self.monthlyMultiModalData: 
+            return self.monthlyMultiModalData[key]
+        
         # open and join the input fields
-        mm_store = pd.HDFStore(self.multimodal_file)
-        demand_store = pd.HDFStore(self.demand_file)
-        trip_store = pd.HDFStore(self.trip_file)
-        gtfs_store = pd.HDFStore(self.gtfs_file)
+        with pd.HDFStore(self.multimodal_file, mode='r') as mm_store: 
+            transit = mm_store.select('transitMonthly')
+            fares = mm_store.select('transitFare')
+            bart = mm_store.select('bart_weekday', where="FROM='Entries' and TO='Exits'")
         
-        transit = mm_store.select('transitMonthly')
-        fares = mm_store.select('transitFare')
-        acs = demand_store.select('countyACS', where="FIPS=fips")
-        bart = mm_store.select('bart_weekday', where="FROM='Entries' and TO='Exits'")
+            # extrapolated schedule data
+            servmiles_extrapolated = mm_store.select('exrapolatedServiceMiles')
+            
+        with pd.HDFStore(self.demand_file, mode='r') as demand_store: 
+            acs = demand_store.select('countyACS', where="FIPS=fips")
         
         # schedule data
-        gtfs_bart     = gtfs_store.select('bartMonthly', where='DOW=1 and ROUTE_TYPE=1')
-        gtfs_munibus  = gtfs_store.select('sfmuniMonthly', where='DOW=1 and ROUTE_TYPE=3')
-        gtfs_munirail = gtfs_store.select('sfmuniMonthly', where='DOW=1 and ROUTE_TYPE=0')
-        gtfs_municc   = gtfs_store.select('sfmuniMonthly', where='DOW=1 and ROUTE_TYPE=5')     
-        
-        # extrapolated schedule data
-        servmiles_extrapolated = mm_store.select('exrapolatedServiceMiles')
+        with pd.HDFStore(self.gtfs_file, mode='r') as gtfs_store: 
+            gtfs_bart     = gtfs_store.select('bartMonthly', where='DOW=1 and ROUTE_TYPE=1', columns=gtfsColumns)
+            gtfs_munibus  = gtfs_store.select('sfmuniMonthly', where='DOW=1 and ROUTE_TYPE=3', columns=gtfsColumns)
+            gtfs_munirail = gtfs_store.select('sfmuniMonthly', where='DOW=1 and ROUTE_TYPE=0', columns=gtfsColumns)
+            gtfs_municc   = gtfs_store.select('sfmuniMonthly', where='DOW=1 and ROUTE_TYPE=5', columns=gtfsColumns)     
         
         # more specific data
-        trips = trip_store.select('system_day', where='DOW=1') 
+        with pd.HDFStore(self.trip_file, mode='r') as trip_store: 
+            trips = trip_store.select('system_day', where='DOW=1') 
+            
         muni = trips[['MONTH']].copy()
         muni['APC_ON_MUNI_BUS'] = trips['ON']
         bart['APC_ON_BART'] = bart['RIDERS']
-        
-        mm_store.close()
-        demand_store.close()
-        trip_store.close()
-        gtfs_store.close()
 
         # join all the others with the month being equivalent
-        df = pd.merge(bart, transit, how='left', on=['MONTH'],  sort=True, suffixes=('', '_PERFREPORT')) 
-        df = pd.merge(df, fares, how='left', on=['MONTH'],  sort=True, suffixes=('', '_FARE')) 
-        df = pd.merge(df, acs, how='left', on=['MONTH'],  sort=True, suffixes=('', '_ACS')) 
-        df = pd.merge(df, muni, how='left', on=['MONTH'],  sort=True, suffixes=('', '_MUNI')) 
-
-        # do the first one twice so we get the suffixes right
-        df = pd.merge(df, gtfs_bart, how='left', on=['MONTH'],  sort=True, suffixes=('', '_NOT_USED')) 
-        df = pd.merge(df, gtfs_bart, how='left', on=['MONTH'],  sort=True, suffixes=('', '_GTFS_BART')) 
-        df = pd.merge(df, gtfs_munibus, how='left', on=['MONTH'],  sort=True, suffixes=('', '_GTFS_MUNI_BUS')) 
-        df = pd.merge(df, gtfs_munirail, how='left', on=['MONTH'],  sort=True, suffixes=('', '_GTFS_MUNI_RAIL')) 
-        df = pd.merge(df, gtfs_municc, how='left', on=['MONTH'],  sort=True, suffixes=('', '_GTFS_MUNI_CC')) 
-        
-        # merge extrapolated service miles
-        df = pd.merge(df, servmiles_extrapolated, how='left', on=['MONTH'], sort=True, suffixes=('', '_EXTRAP'))
-        
+        tables = [(transit, '_PERFREPORT'), 
+                  (fares,   '_FARE'), 
+                  (acs,     '_ACS'), 
+                  (muni,    '_MUNI')]
+
+        # the estimation files also use an unlabelled copy of the BART 
+        # schedule data, so that goes first
+        tables.append((gtfs_bart, '_NOT_USED'))
+        
+        # the schedule data have the same columns for each operator, 
+        # so label them all by operator before joining
+        gtfs = [(gtfs_bart,     '_GTFS_BART'), 
+                (gtfs_munibus,  '_GTFS_MUNI_BUS'), 
+                (gtfs_munirail, '_GTFS_MUNI_RAIL'), 
+                (gtfs_municc,   '_GTFS_MUNI_CC')]
+        for table, suffix in gtfs: 
+            table = table.rename(columns={c: c + suffix for c in table.columns if c != 'MONTH'})
+            tables.append((table, suffix))
+        
+        # and the extrapolated service miles
+        tables.append((servmiles_extrapolated, '_EXTRAP'))
+        
+        df = joinOnMonth(bart, tables)
+        
+        self.monthlyMultiModalData[key] = df
         return df
 
         
@@ -1664,9 +1534,14 @@ class TransitReporter():
         Writes a drivers of demand for all months to the specified excel file.        
         '''    
          
-        # establish the writer        
+        # establish the writer.  In constant memory mode, rows are flushed
+        # to disk as we go, so each sheet must be written top to bottom. 
         self.writer = pd.ExcelWriter(xlsfile, engine='xlsxwriter',
-                        datetime_format='mmm-yyyy')        
+                        datetime_format='mmm-yyyy', 
+                        options={'constant_memory': True})        
+        
+        # set up the formatting once for the whole workbook
+        self.set_formats()
         
         self.writeAnnualMultiModalSheet(fips=fips, sheetName='Fiscal Year', comments=comments)
         self.writeMonthlyMultiModalSheet(fips=fips, sheetName='Monthly', comments=comments)
@@ -1682,18 +1557,16 @@ class TransitReporter():
         # get the actual data
         df = self.assembleAnnualMultiModalData(fips)    
 
-        # Write the month as the column headers
+        # the column headers are written with the values
         years = df[['FISCAL_YEAR']]
-        years.T.to_excel(self.writer, sheet_name=sheetName,  
-                                startrow=10, startcol=7, header=False, index=False)
                     
-    
-        # note that we have to call the pandas function first to get the
-        # excel sheet created properly, so now we can access that
-        worksheet = self.writer.sheets[sheetName]
+        # create the sheet directly, so the header rows can be 
+        # written before any of the data
+        worksheet = self.writer.book.add_worksheet(sheetName)
+        self.writer.sheets[sheetName] = worksheet
             
-        # set up the formatting, with defaults
-        bold = self.writer.book.add_format({'bold': 1})        
+        # formatting, with defaults
+        bold = self.bold
             
         # set the column widths
         worksheet.set_column(0, 0, 1)
@@ -1706,28 +1579,72 @@ class TransitReporter():
         worksheet.set_column(7, 1000, 12)                
             
         # write the header
-        worksheet.write(1, 1, 'San Francisco MultiModal Performance Report', bold)
-        worksheet.write(3, 1, 'Input Specification', bold)
-        worksheet.write(4, 2, 'Geographic Extent: ')
-        worksheet.write(4, 3, 'San Francisco County')
-        worksheet.write(5, 2, 'Temporal Resolution: ')
-        worksheet.write(5, 3, 'Fiscal Year')
-        worksheet.write(6, 2, 'Report Generated on: ')
-        worksheet.write(6, 3, timestring)
-        worksheet.write(7, 2, 'Comments: ')      
-        worksheet.write(8, 3, comments)        
+        self.write_header(worksheet, 'San Francisco MultiModal Performance Report', 
+                          'San Francisco County', 'Fiscal Year', timestring, comments)
             
         # Use formulas to calculate the differences
+        # the rows are the same in each block, so only list them once
+        sections = self.getAnnualMultiModalSections(df)
+        
         self.set_position(self.writer, worksheet, 7, 2)  
-        self.writeAnnualMultiModalValues(df, years, sheetName, 'values')
-        self.writeAnnualMultiModalValues(df, years, sheetName, 'diff')
-        self.writeAnnualMultiModalValues(df, years, sheetName, 'pctDiff')
+        self.writeAnnualMultiModalValues(df, sections, years, sheetName, 'values')
+        self.writeAnnualMultiModalValues(df, sections, years, sheetName, 'diff')
+        self.writeAnnualMultiModalValues(df, sections, years, sheetName, 'pctDiff')
             
         # freeze so we can see what's happening
         worksheet.freeze_panes(0, 7)
             
 
-    def writeAnnualMultiModalValues(self, df, years, sheetName, formulaType='values'):
+    def getAnnualMultiModalSections(self, df):
+        '''
+        Lists the rows of the fiscal year sheet, grouped into sections. 
+        This is done once per sheet, and shared by the values, difference
+        and percent difference blocks. 
+        
+        Returns a list of (header, rows) tuples, where each row is a 
+        (label, column, source, tempRes, geogRes, format) tuple. 
+        '''
+        # formatting, with defaults
+        int_format = self.int_format
+        cent_format = self.cent_format
+        
+        # the available fields, for quick look-ups
+        columns = set(df.columns)
+        
+        sections = []
+        
+        # TRANSIT STATISTICAL SUMMARY DATA
+        measures = [('Annual Service Miles', 'SERVMILES', 'Transit Stat Summary', 'FY', 'System', int_format), 
+                    ('Annual Ridership', 'PASSENGERS', 'Transit Stat Summary', 'FY', 'System', int_format), 
+                    ('Average Weekday Ridership', 'AVG_WEEKDAY_RIDERSHIP', 'Transit Stat Summary', 'FY', 'System', int_format), 
+                    ('Average Weekday Ridership', 'AVG_WEEKDAY_RIDERSHIP_STAFF', 'SFMTA Staff Estimate', 'FY', 'System', int_format), 
+                    ('Average Weekday Ridership', 'APC_ON', 'APCs/Faregate', 'Monthly', 'Stop', int_format), 
+                    ('Average Fare (2010$)', 'AVG_FARE_2010USD', 'Transit Stat Summary', 'FY', 'System', cent_format), 
+                    ('Cash Fare (2010$)', 'CASH_FARE_2010USD', 'Published Values', 'Actual', 'System', cent_format), 
+                    ]
+        
+        modes = [('Muni Bus+Rail', 'MUNI'), 
+                 ('Muni Bus', 'MUNI_BUS'),
+                 ('Muni Cable Car', 'MUNI_CC'),
+                 ('Muni Rail', 'MUNI_RAIL'),
+                 ('BART', 'BART'),
+                 ('Caltrain', 'CALTRAIN')
+                ]
+                
+        for header, measure, source, tempRes, geogRes, format in measures: 
+            rows = []
+            for label, mode in modes: 
+                if measure + '_' + mode in columns: 
+                    rows.append((label, measure + '_' + mode, source, tempRes, geogRes, format))
+            sections.append((header, rows))
+
+        # MODE SHARES, overall and by segment
+        sections += self.getModeShareSections()
+        
+        return sections
+        
+
+    def writeAnnualMultiModalValues(self, df, sections, years, sheetName, formulaType='values'):
         '''
         Writes the main system values to the worksheet. 
         '''
@@ -1743,13 +1660,8 @@ class TransitReporter():
         # get the worksheet
         worksheet = self.writer.sheets[sheetName]      
         
-        # set up the formatting, with defaults
-        bold = self.writer.book.add_format({'bold': 1})
-        int_format = self.writer.book.add_format({'num_format': '#,##0'})
-        dec_format = self.writer.book.add_format({'num_format': '#,##0.00'})
-        cent_format = self.writer.book.add_format({'num_format': '$#,##0.00'})
-        dollar_format = self.writer.book.add_format({'num_format': '$#,##0'})
-        percent_format = self.writer.book.add_format({'num_format': '0.0%'})
+        # formatting, with defaults
+        bold = self.bold
         
         # HEADER
         if formulaType=='diff': 
@@ -1764,101 +1676,11 @@ class TransitReporter():
         worksheet.write(self.row, 4, 'Temporal Res', bold)        
         worksheet.write(self.row, 5, 'Geog Res', bold)        
         worksheet.write(self.row, 6, 'Trend', bold) 
-        years.T.to_excel(self.writer, sheet_name=sheetName, 
-                            startrow=self.row, startcol=7, header=False, index=False) 
+        worksheet.write_row(self.row, 7, years['FISCAL_YEAR'].tolist()) 
         self.row += 1       
 
-        
-        # TRANSIT STATISTICAL SUMMARY DATA
-        measures = [('Annual Service Miles', 'SERVMILES', 'Transit Stat Summary', 'FY', 'System', int_format), 
-                    ('Annual Ridership', 'PASSENGERS', 'Transit Stat Summary', 'FY', 'System', int_format), 
-                    ('Average Weekday Ridership', 'AVG_WEEKDAY_RIDERSHIP', 'Transit Stat Summary', 'FY', 'System', int_format), 
-                    ('Average Weekday Ridership', 'AVG_WEEKDAY_RIDERSHIP_STAFF', 'SFMTA Staff Estimate', 'FY', 'System', int_format), 
-                    ('Average Weekday Ridership', 'APC_ON', 'APCs/Faregate', 'Monthly', 'Stop', int_format), 
-                    ('Average Fare (2010$)', 'AVG_FARE_2010USD', 'Transit Stat Summary', 'FY', 'System', cent_format), 
-                    ('Cash Fare (2010$)', 'CASH_FARE_2010USD', 'Published Values', 'Actual', 'System', cent_format), 
-                    ]
-        
-        modes = [('Muni Bus+Rail', 'MUNI'), 
-                 ('Muni Bus', 'MUNI_BUS'),
-                 ('Muni Cable Car', 'MUNI_CC'),
-                 ('Muni Rail', 'MUNI_RAIL'),
-                 ('BART', 'BART'),
-                 ('Caltrain', 'CALTRAIN')
-                ]
-                
-        for header, measure, source, tempRes, geogRes, format in measures: 
-            worksheet.write(self.row, 1, header, bold)
-            self.row += 1
-                
-            for label, mode in modes: 
-                if measure + '_' + mode in df.columns: 
-
-                    if formulaType=='values':
-                        self.write_row(label=label, data=df[[measure + '_' + mode]], 
-                            source=source, tempRes=tempRes, geogRes=geogRes, format=format)
-
-                    else: 
-                        self.write_difference_row(label=label, 
-                            row_offset=ROW_OFFSET, col_offset=COL_OFFSET, max_col=max_col,
-                            source=source, tempRes=tempRes, geogRes=geogRes, format=format, 
-                            formulaType=formulaType)
-
-        # MODE SHARES        
-        modes = [('DA',      'Drive-Alone'), 
-                 ('SR',      'Carpool'),
-                 ('TRANSIT', 'Transit'),
-                 ('BIKE',    'Bicycle'),
-                 ('WALK',    'Walk'),
-                 ('OTHER',   'Taxi, other'),
-                 ('HOME',    'Work at home')]
-
-        worksheet.write(self.row, 1, 'Commute Mode Shares', bold)
-        self.row += 1
-
-        for mode, modeName in modes: 
-            key = 'JTW_' + mode + '_SHARE'
-            label =  modeName
-            
-            if formulaType=='values':
-                self.write_row(label=label, data=df[[key]], 
-                    source='ACS', tempRes='Annual', geogRes='County', format=percent_format)
-            else: 
-                self.write_difference_row(label=label, 
-                    row_offset=ROW_OFFSET, col_offset=COL_OFFSET, max_col=max_col,
-                    source='ACS', tempRes='Annual', geogRes='County', format=percent_format, 
-                            formulaType=formulaType)
-
-
-        # MODE SHARES BY SEGMENT   
-        groups = [('JTW_EARN0_50_',    'Workers earning $0-50k: '),
-                  ('JTW_EARN50P_',     'Workers earning $50k+: '),
-                  ('JTW_0VEH_',        'Workers with 0 vehicles: '),
-                  ('JTW_1PVEH_',       'Workers with 1+ vehicles: ')]
-
-        modes = [('DA',      'Drive-Alone'), 
-                 ('SR',      'Carpool'),
-                 ('TRANSIT', 'Transit'),
-                 ('WALK_OTHER','Taxi, walk, bike, other'),
-                 ('HOME',    'Work at home')]
-
-        worksheet.write(self.row, 1, 'Commute Mode Shares by Segment', bold)
-        self.row += 1
-
-        for group, groupName in groups: 
-            for mode, modeName in modes: 
-
-                key = group + mode + '_SHARE'
-                label = groupName + modeName
-
-                if formulaType=='values':         
-                    self.write_row(label=label, data=df[[key]], 
-                        source='ACS', tempRes='Annual', geogRes='County', format=percent_format)
-                else: 
-                    self.write_difference_row(label=label, 
-                        row_offset=ROW_OFFSET, col_offset=COL_OFFSET, max_col=max_col,
-                        source='ACS', tempRes='Annual', geogRes='County', format=percent_format, 
-                                formulaType=formulaType)
+        # and the data
+        self.write_sections(df, sections, ROW_OFFSET, COL_OFFSET, max_col, formulaType)
 
 
     def writeMonthlyMultiModalSheet(self, fips, sheetName, comments=None):         
@@ -1866,21 +1688,20 @@ class TransitReporter():
         timestring = str(pd.Timestamp(datetime.datetime.now()))
         timestring = timestring.split('.')[0]
 
-        # get the actual data
-        df = self.assembleMonthlyMultiModalData(fips)    
+        # get the actual data, reading only the schedule fields in the report
+        gtfsColumns = ['MONTH', 'STOPS', 'SERVMILES_S', 'HEADWAY_S', 'RUNSPEED_S', 'TOTSPEED_S']
+        df = self.assembleMonthlyMultiModalData(fips, gtfsColumns=gtfsColumns)    
 
-        # Write the month as the column headers
+        # the column headers are written with the values
         periods = df[['MONTH']]
-        periods.T.to_excel(self.writer, sheet_name=sheetName,  
-                                startrow=10, startcol=7, header=False, index=False)
                     
-    
-        # note that we have to call the pandas function first to get the
-        # excel sheet created properly, so now we can access that
-        worksheet = self.writer.sheets[sheetName]
+        # create the sheet directly, so the header rows can be 
+        # written before any of the data
+        worksheet = self.writer.book.add_worksheet(sheetName)
+        self.writer.sheets[sheetName] = worksheet
             
-        # set up the formatting, with defaults
-        bold = self.writer.book.add_format({'bold': 1})        
+        # formatting, with defaults
+        bold = self.bold
             
         # set the column widths
         worksheet.set_column(0, 0, 1)
@@ -1893,68 +1714,40 @@ class TransitReporter():
         worksheet.set_column(7, 1000, 12)                
             
         # write the header
-        worksheet.write(1, 1, 'San Francisco MultiModal Performance Report', bold)
-        worksheet.write(3, 1, 'Input Specification', bold)
-        worksheet.write(4, 2, 'Geographic Extent: ')
-        worksheet.write(4, 3, 'San Francisco County')
-        worksheet.write(5, 2, 'Temporal Resolution: ')
-        worksheet.write(5, 3, 'Month')
-        worksheet.write(6, 2, 'Report Generated on: ')
-        worksheet.write(6, 3, timestring)
-        worksheet.write(7, 2, 'Comments: ')      
-        worksheet.write(8, 3, comments)        
+        self.write_header(worksheet, 'San Francisco MultiModal Performance Report', 
+                          'San Francisco County', 'Month', timestring, comments)
             
         # Use formulas to calculate the differences
+        # the rows are the same in each block, so only list them once
+        sections = self.getMonthlyMultiModalSections(df)
+        
         self.set_position(self.writer, worksheet, 7, 2)  
-        self.writeMonthlyMultiModalValues(df, periods, sheetName, 'values')
-        self.writeMonthlyMultiModalValues(df, periods, sheetName, 'diff')
-        self.writeMonthlyMultiModalValues(df, periods, sheetName, 'pctDiff')
+        self.writeMonthlyMultiModalValues(df, sections, periods, sheetName, 'values')
+        self.writeMonthlyMultiModalValues(df, sections, periods, sheetName, 'diff')
+        self.writeMonthlyMultiModalValues(df, sections, periods, sheetName, 'pctDiff')
                         
         # freeze so we can see what's happening
         worksheet.freeze_panes(0, 7)
 
 
-    def writeMonthlyMultiModalValues(self, df, months, sheetName, formulaType='values'):
+    def getMonthlyMultiModalSections(self, df):
         '''
-        Writes the main system values to the worksheet. 
-        '''
-                
-        # leave a couple of empty spaces
-        self.row += 2
-        
-        # which cells to look at
-        ROW_OFFSET = self.row - 9
-        COL_OFFSET = 12
-        max_col = 6+len(months)+1
-
-        # get the worksheet
-        worksheet = self.writer.sheets[sheetName]        
-        
-        # set up the formatting, with defaults
-        bold = self.writer.book.add_format({'bold': 1})
-        int_format = self.writer.book.add_format({'num_format': '#,##0'})
-        dec_format = self.writer.book.add_format({'num_format': '#,##0.00'})
-        cent_format = self.writer.book.add_format({'num_format': '$#,##0.00'})
-        dollar_format = self.writer.book.add_format({'num_format': '$#,##0'})
-        percent_format = self.writer.book.add_format({'num_format': '0.0%'})
+        Lists the rows of the monthly sheet, grouped into sections. 
+        This is done once per sheet, and shared by the values, difference
+        and percent difference blocks. 
         
+        Returns a list of (header, rows) tuples, where each row is a 
+        (label, column, source, tempRes, geogRes, format) tuple. 
+        '''
+        # formatting, with defaults
+        int_format = self.int_format
+        dec_format = self.dec_format
+        cent_format = self.cent_format
         
-        # HEADER
-        if formulaType=='diff': 
-            worksheet.write(self.row, 7, 'Difference from year before', bold)
-        elif formulaType=='pctDiff': 
-            worksheet.write(self.row, 7, 'Percent difference from year before', bold)
-        else:        
-            worksheet.write(self.row, 7, 'Values', bold)
-        self.row += 1
+        # the available fields, for quick look-ups
+        columns = set(df.columns)
         
-        worksheet.write(self.row, 3, 'Source', bold)        
-        worksheet.write(self.row, 4, 'Temporal Res', bold)        
-        worksheet.write(self.row, 5, 'Geog Res', bold)        
-        worksheet.write(self.row, 6, 'Trend', bold) 
-        months.T.to_excel(self.writer, sheet_name=sheetName, 
-                            startrow=self.row, startcol=7, header=False, index=False) 
-        self.row += 1       
+        sections = []
         
         # TRANSIT STATISTICAL SUMMARY DATA
         measures = [('Monthly Service Miles', 'SERVMILES', 'Transit Stat Summary', 'FY', 'System', int_format),
@@ -1979,24 +1772,68 @@ class TransitReporter():
                  ('BART', 'BART'),
                  ('Caltrain', 'CALTRAIN')
                 ]
-                                                                           
-        for header, measure, source, tempRes, geogRes, format in measures: 
-            worksheet.write(self.row, 1, header, bold)
-            self.row += 1
                 
+        for header, measure, source, tempRes, geogRes, format in measures: 
+            rows = []
             for label, mode in modes: 
-                if measure + '_' + mode in df.columns:                     
-                    if formulaType=='values':
-                        self.write_row(label=label, data=df[[measure + '_' + mode]], 
-                            source=source, tempRes=tempRes, geogRes=geogRes, format=format)
+                if measure + '_' + mode in columns: 
+                    rows.append((label, measure + '_' + mode, source, tempRes, geogRes, format))
+            sections.append((header, rows))
+
+        # MODE SHARES, overall and by segment
+        sections += self.getModeShareSections()
+        
+        return sections
+        
+
+    def writeMonthlyMultiModalValues(self, df, sections, months, sheetName, formulaType='values'):
+        '''
+        Writes the main system values to the worksheet. 
+        '''
+                
+        # leave a couple of empty spaces
+        self.row += 2
+        
+        # which cells to look at
+        ROW_OFFSET = self.row - 9
+        COL_OFFSET = 12
+        max_col = 6+len(months)+1
+
+        # get the worksheet
+        worksheet = self.writer.sheets[sheetName]        
+        
+        # formatting, with defaults
+        bold = self.bold
+        
+        # HEADER
+        if formulaType=='diff': 
+            worksheet.write(self.row, 7, 'Difference from year before', bold)
+        elif formulaType=='pctDiff': 
+            worksheet.write(self.row, 7, 'Percent difference from year before', bold)
+        else:        
+            worksheet.write(self.row, 7, 'Values', bold)
+        self.row += 1
+        
+        worksheet.write(self.row, 3, 'Source', bold)        
+        worksheet.write(self.row, 4, 'Temporal Res', bold)        
+        worksheet.write(self.row, 5, 'Geog Res', bold)        
+        worksheet.write(self.row, 6, 'Trend', bold) 
+        self.write_months(worksheet, self.row, 7, months) 
+        self.row += 1       
 
-                    else: 
-                        self.write_difference_row(label=label, 
-                            row_offset=ROW_OFFSET, col_offset=COL_OFFSET, max_col=max_col,
-                            source=source, tempRes=tempRes, geogRes=geogRes, format=format, 
-                            formulaType=formulaType)
+        # and the data
+        self.write_sections(df, sections, ROW_OFFSET, COL_OFFSET, max_col, formulaType)
 
 
+    def getModeShareSections(self):
+        '''
+        Lists the commute mode share rows, which are the same on the 
+        fiscal year and monthly sheets, in the same form as the other
+        sections. 
+        '''
+        percent_format = self.percent_format
+        sections = []
+        
         # MODE SHARES        
         modes = [('DA',      'Drive-Alone'), 
                  ('SR',      'Carpool'),
@@ -2006,22 +1843,11 @@ class TransitReporter():
                  ('OTHER',   'Taxi, other'),
                  ('HOME',    'Work at home')]
 
-        worksheet.write(self.row, 1, 'Commute Mode Shares', bold)
-        self.row += 1
-
+        rows = []
         for mode, modeName in modes: 
-            key = 'JTW_' + mode + '_SHARE'
-            label =  modeName
-            
-            if formulaType=='values':
-                self.write_row(label=label, data=df[[key]], 
-                    source='ACS', tempRes='Annual', geogRes='County', format=percent_format)
-            else: 
-                self.write_difference_row(label=label, 
-                    row_offset=ROW_OFFSET, col_offset=COL_OFFSET, max_col=max_col,
-                    source='ACS', tempRes='Annual', geogRes='County', format=percent_format, 
-                            formulaType=formulaType)
-
+            rows.append((modeName, 'JTW_' + mode + '_SHARE', 
+                         'ACS', 'Annual', 'County', percent_format))
+        sections.append(('Commute Mode Shares', rows))
 
         # MODE SHARES BY SEGMENT   
         groups = [('JTW_EARN0_50_',    'Workers earning $0-50k: '),
@@ -2035,34 +1861,23 @@ class TransitReporter():
                  ('WALK_OTHER','Taxi, walk, bike, other'),
                  ('HOME',    'Work at home')]
 
-        worksheet.write(self.row, 1, 'Commute Mode Shares by Segment', bold)
-        self.row += 1
-
+        rows = []
         for group, groupName in groups: 
             for mode, modeName in modes: 
-
-                key = group + mode + '_SHARE'
-                label = groupName + modeName
-
-                if formulaType=='values':
-                    self.write_row(label=label, data=df[[key]], 
-                        source='ACS', tempRes='Annual', geogRes='County', format=percent_format)
-                else: 
-                    self.write_difference_row(label=label, 
-                        row_offset=ROW_OFFSET, col_offset=COL_OFFSET, max_col=max_col,
-                        source='ACS', tempRes='Annual', geogRes='County', format=percent_format, 
-                                formulaType=formulaType)
-
+                rows.append((groupName + modeName, group + mode + '_SHARE', 
+                             'ACS', 'Annual', 'County', percent_format))
+        sections.append(('Commute Mode Shares by Segment', rows))
+        
+        return sections
 
                         
         
-    def writeSFMuniEstimationFile(self, estfile, fips, dow=1, tod='Daily'):
+    def writeSFMuniEstimationFile(self, estfile, fips, dow=1, tod='Daily', fmt='csv'):
         '''
         Writes a model estimation file for SF MUNI busses.        
+        
+        fmt - 'csv', or 'parquet' to write a .parquet file alongside estfile
         '''     
-                
-        # get a filename for the differences
-        base = os.path.splitext(estfile)
 
         # get the data
         muni = self.assembleSystemPerformanceData(fips, dow=dow, tod=tod)
@@ -2074,9 +1889,12 @@ class TransitReporter():
         
         # merge the data        
         df = muni
-        df = pd.merge(df, multimodal, how='left', on=['MONTH'], sort=True, suffixes=('', '_MM')) 
-        df = pd.merge(df, demand, how='left', on=['MONTH'], sort=True, suffixes=('', '_DEMAND')) 
-        #df = pd.merge(df, demand, how='right', on=['MONTH'], sort=True, suffixes=('', '_DEMAND')) 
+        df = pd.merge(df, multimodal, how='left', on=['MONTH'], suffixes=('', '_MM')) 
+        df = pd.merge(df, demand, how='left', on=['MONTH'], suffixes=('', '_DEMAND')) 
+        #df = pd.merge(df, demand, how='right', on=['MONTH'], suffixes=('', '_DEMAND')) 
+        
+        # sort once, rather than in every merge
+        df = df.sort_values('MONTH', kind='mergesort').reset_index(drop=True)
         
         # more additional fields
         df['CASH_FARE_INC_MUNI'] = df['CASH_FARE_2010USD_MUNI'] / df['MEDIAN_HHINC_2010USD']
@@ -2095,13 +1913,16 @@ class TransitReporter():
         df['BART_STRIKE_DAYS'] = np.where(df['MONTH']==pd.to_datetime('2013-07-01'), 4, df['BART_STRIKE_DAYS'])
         df['BART_STRIKE_DAYS'] = np.where(df['MONTH']==pd.to_datetime('2013-10-01'), 3, df['BART_STRIKE_DAYS'])
                 
-        # write the data
-        df.to_csv(estfile)
+        # write the data, with the integers stored as compactly as possible
+        df = downcastIntegers(df)
+        writeEstimationData(df, estfile, fmt)
 
 
-    def writeBARTEstimationFile(self, estfile, fipsList):
+    def writeBARTEstimationFile(self, estfile, fipsList, fmt='csv'):
         '''
         Writes a model estimation file for BART ridership       
+        
+        fmt - 'csv', or 'parquet' to write a .parquet file alongside estfile
         '''     
         
         # get the basic data, including the 4-county total demand data
@@ -2113,20 +1934,19 @@ class TransitReporter():
         muni = muni.interpolate()
         
         # merge the data      
-        df = pd.merge(multimodal, demand, how='left', on=['MONTH'], sort=True, suffixes=('', '_DEMAND')) 
-        df = pd.merge(df, demand, how='left', on=['MONTH'], sort=True, suffixes=('', '_MUNI_BUS')) 
+        df = pd.merge(multimodal, demand, how='left', on=['MONTH'], suffixes=('', '_DEMAND')) 
+        df = pd.merge(df, demand, how='left', on=['MONTH'], suffixes=('', '_MUNI_BUS')) 
         
         # now, merge the county-specific demand data
         for fips, countyName, abbreviation in fipsList: 
             demand = self.assembleDemandData(fips)
-            df = pd.merge(df, demand, how='left', on=['MONTH'], sort=True, suffixes=('', '_' + abbreviation)) 
+            df = pd.merge(df, demand, how='left', on=['MONTH'], suffixes=('', '_' + abbreviation)) 
+        
+        # sort once, rather than in every merge
+        df = df.sort_values('MONTH', kind='mergesort').reset_index(drop=True)
         
         # additional fields
-        for col in demand.columns: 
-            if col+'_Total' in df.columns: 
-                if (df[col+'_Total'].dtype==np.float64) or (df[col+'_Total'].dtype==np.int64) : 
-                    df[col+'_3COUNTY'] = df[col+'_Total'] - df[col+'_SFC']
-                    df[col+'_SFSHARE'] = df[col+'_SFC'] / df[col+'_Total'] 
+        df = addThreeCountyFields(df, demand.columns)
                     
         # more additional fields
         df['CASUAL_CARPOOL'] = np.where(df['TOLL_BB_CARPOOL_2010USD']>0, 0, 1)
@@ -2140,8 +1960,9 @@ class TransitReporter():
         df['BART_STRIKE_DAYS'] = np.where(df['MONTH']==pd.to_datetime('2013-10-01'), 3, df['BART_STRIKE_DAYS'])
         
 
-        # write the data
-        df.to_csv(estfile)
+        # write the data, with the integers stored as compactly as possible
+        df = downcastIntegers(df)
+        writeEstimationData(df, estfile, fmt)
 
 
     def assembleNTDData(self, ntd_dir, field, ntdid, modes): 
@@ -2268,11 +2089,7 @@ class TransitReporter():
             df = pd.merge(df, demand, how='left', on=['MONTH'], sort=True, suffixes=('', '_' + abbreviation)) 
         
         # additional fields
-        for col in demand.columns: 
-            if col+'_Total' in df.columns: 
-                if (df[col+'_Total'].dtype==np.float64) or (df[col+'_Total'].dtype==np.int64) : 
-                    df[col+'_3COUNTY'] = df[col+'_Total'] - df[col+'_SFC']
-                    df[col+'_SFSHARE'] = df[col+'_SFC'] / df[col+'_Total'] 
+        df = addThreeCountyFields(df, demand.columns)
                     
         # more additional fields
         df['CASUAL_CARPOOL'] = np.where(df['TOLL_BB_CARPOOL_2010USD']>0, 0, 1)
@@ -2298,7 +2115,96 @@ class TransitReporter():
         self.worksheet = worksheet
         self.row = row
         self.col = col
+        self.sparklines = []
+        
+        
+
+    def set_formats(self):
+        '''
+        Adds the formats used by the report rows to the workbook.  This 
+        is done once per workbook, rather than every time a block or row 
+        is written.  
+        '''
+        book = self.writer.book
+        self.bold = book.add_format({'bold': 1})
+        self.int_format = book.add_format({'num_format': '#,##0'})
+        self.dec_format = book.add_format({'num_format': '#,##0.00'})
+        self.cent_format = book.add_format({'num_format': '$#,##0.00'})
+        self.dollar_format = book.add_format({'num_format': '$#,##0'})
+        self.percent_format = book.add_format({'num_format': '0.0%'})
+        self.date_format = book.add_format({'num_format': 'mmm-yyyy'})
+        
+
+    def write_months(self, worksheet, row, col, months):
+        '''
+        Writes the months across a row as column headers.  This goes 
+        straight to the worksheet, rather than through the pandas excel
+        formatter, and is only valid once the sheet exists and the 
+        formats are set. 
+        
+        months - dataframe with a MONTH column
+        '''
+        worksheet.write_row(row, col, months['MONTH'].dt.to_pydatetime(), self.date_format)
+        
+
+    def write_system_header(self, worksheet, geography, dowString, tod, 
+                            timestring, comments):
+        '''
+        Writes the title and input specification at the top of a system
+        or route performance sheet, one row at a time. 
+        '''
+        worksheet.write(1, 1, 'SFMTA Transit Performance Report', self.bold)
+        worksheet.write(3, 1, 'Input Specification', self.bold)
+        worksheet.write_row(4, 2, ['Geographic Extent: ', geography])
+        worksheet.write_row(5, 2, ['Day-of-Week: ', dowString])
+        worksheet.write_row(6, 2, ['Time-of-Day: ', tod])
+        worksheet.write_row(7, 2, ['Report Generated on: ', timestring])
+        worksheet.write_row(8, 2, ['Comments: ', comments])
         
+
+    def write_header(self, worksheet, title, geography, tempRes, timestring, comments):
+        '''
+        Writes the title and input specification at the top of a sheet, 
+        one row at a time. 
+        '''
+        worksheet.write(1, 1, title, self.bold)
+        worksheet.write(3, 1, 'Input Specification', self.bold)
+        worksheet.write_row(4, 2, ['Geographic Extent: ', geography])
+        worksheet.write_row(5, 2, ['Temporal Resolution: ', tempRes])
+        worksheet.write_row(6, 2, ['Report Generated on: ', timestring])
+        worksheet.write(7, 2, 'Comments: ')
+        worksheet.write(8, 3, comments)
+        
+
+    def write_labels(self, label, source, tempRes, geogRes):
+        '''
+        Writes the label, source and resolution text at the start of the 
+        current row.  These are always strings, so they go straight to 
+        write_string, skipping the type checks in write(). 
+        '''
+        for c, text in enumerate((label, source, tempRes, geogRes)): 
+            self.worksheet.write_string(self.row, self.col+c, text)
+        
+
+    def write_values(self, values, col=None):
+        '''
+        Writes an array of numbers across the current row, following the 
+        labels.  Missing values are left blank and infinite values are 
+        written as text, as they are when written through pandas.  
+        
+        col - the first column of values, by default following the four
+              label columns
+        '''
+        if col is None: 
+            col = self.col+5
+        
+        for c, value in enumerate(values): 
+            if pd.isnull(value): 
+                continue
+            elif np.isinf(value): 
+                self.worksheet.write_string(self.row, col+c, 'inf' if value > 0 else '-inf')
+            else: 
+                self.worksheet.write_number(self.row, col+c, value)
         
                                     
     def write_row(self, label, source, tempRes, geogRes, data, format, sparkline=True):
@@ -2312,32 +2218,81 @@ class TransitReporter():
         source - string source to write in second column
         res - string resolution to write in third column
         format - number format for the row
-        sparkline - boolean indicating whether or not to add a sparkline
+        sparkline - boolean indicating whether or not to add a sparkline. 
+                    These are collected, and added as one group by 
+                    add_sparklines. 
         
         '''
         
+        # format, which has to be set before the row's cells are written
+        self.worksheet.set_row(self.row, None, format) 
+
         # labels
-        self.worksheet.write(self.row, self.col, label)
-        self.worksheet.write(self.row, self.col+1, source)
-        self.worksheet.write(self.row, self.col+2, tempRes)
-        self.worksheet.write(self.row, self.col+3, geogRes)
+        self.write_labels(label, source, tempRes, geogRes)
 
-        # data
-        self.worksheet.set_row(self.row, None, format) 
-        data.T.to_excel(self.writer, sheet_name=self.worksheet.get_name(), 
-                            startrow=self.row, startcol=self.col+5, header=False, index=False)
+        # data, written straight to the worksheet 
+        self.write_values(data.values.ravel())
         
         # sparkline
         if sparkline: 
             cell = xl_rowcol_to_cell(self.row, self.col+4)
             data_range = (xl_rowcol_to_cell(self.row, self.col+5) + 
                    ':' + xl_rowcol_to_cell(self.row, self.col+5+len(data)+1))
-            self.worksheet.add_sparkline(cell, {'range': data_range})   
+            self.sparklines.append((cell, data_range))
 
         # increment the row
         self.row += 1
 
                                     
+    def write_sections(self, df, sections, row_offset, col_offset, max_col, 
+        formulaType='values'):
+        '''
+        Writes each section header, followed by its rows, as either values
+        or difference formulas. 
+        
+        sections - list of (header, rows) tuples, where each row is a 
+                   (label, column, source, tempRes, geogRes, format) tuple
+        formulaType - 'values', 'diff' or 'pctDiff'
+        '''
+        for header, rows in sections: 
+            self.worksheet.write(self.row, 1, header, self.bold)
+            self.row += 1
+            
+            for label, column, source, tempRes, geogRes, format in rows: 
+                if formulaType=='values':
+                    self.write_row(label=label, data=df[[column]], 
+                        source=source, tempRes=tempRes, geogRes=geogRes, format=format)
+                else: 
+                    self.write_difference_row(label=label, 
+                        row_offset=row_offset, col_offset=col_offset, max_col=max_col,
+                        source=source, tempRes=tempRes, geogRes=geogRes, format=format, 
+                        formulaType=formulaType)
+        
+        # the trends, as a single sparkline group for the block
+        if formulaType=='values': 
+            self.add_sparklines({})
+        else: 
+            self.add_sparklines({'type': 'column', 'negative_points': True})
+            
+    
+    def add_sparklines(self, options): 
+        '''
+        Adds the sparklines collected from the rows written since the last
+        call as one group, which shares the options.  This writes a single
+        group to the file, rather than one for every row, and each 
+        sparkline still gets its own axis scale. 
+        '''
+        if len(self.sparklines)==0: 
+            return
+        
+        options = dict(options)
+        options['location'] = [cell for cell, data_range in self.sparklines]
+        options['range'] = [data_range for cell, data_range in self.sparklines]
+        self.worksheet.add_sparkline(options['location'][0], options)
+        
+        self.sparklines = []
+            
+                                    
     def write_difference_row(self, row_offset, col_offset, max_col, 
         label, source, tempRes, geogRes, format, sparkline=True, 
         formulaType='diff'):
@@ -2352,39 +2307,40 @@ class TransitReporter():
         source - string source to write in second column
         res - string resolution to write in third column
         format - number format for the row
-        sparkline - boolean indicating whether or not to add a sparkline
+        sparkline - boolean indicating whether or not to add a sparkline. 
+                    These are collected, and added as one group by 
+                    add_sparklines. 
         formulaType - either 'diff' or 'pctDiff'
         '''
         
-        # labels
-        self.worksheet.write(self.row, self.col, label)
-        self.worksheet.write(self.row, self.col+1, source)
-        self.worksheet.write(self.row, self.col+2, tempRes)
-        self.worksheet.write(self.row, self.col+3, geogRes)
-
-        # formats
-        percent_format = self.writer.book.add_format({'num_format': '0.0%'})
+        # formats, which have to be set before the row's cells are written
         if formulaType=='diff': 
             self.worksheet.set_row(self.row, None, format) 
         elif formulaType=='pctDiff': 
-            self.worksheet.set_row(self.row, None, percent_format)             
-        
-        # formulas
-        for c in range(7+col_offset, max_col):
-            cell = xl_rowcol_to_cell(self.row, c)
-            new = xl_rowcol_to_cell(self.row-row_offset, c)
-            old = xl_rowcol_to_cell(self.row-row_offset, c-col_offset)
+            self.worksheet.set_row(self.row, None, self.percent_format)             
+
+        # labels
+        self.write_labels(label, source, tempRes, geogRes)
+        
+        # formulas, as a single array formula across the row.  The checks
+        # are multiplied because AND() would combine the whole array.
+        first_col = 7+col_offset
+        last_col = max_col-1
+        if first_col <= last_col: 
+            r = self.row-row_offset
+            new = cellName(r, first_col) + ':' + cellName(r, last_col)
+            old = cellName(r, first_col-col_offset) + ':' + cellName(r, last_col-col_offset)
             if formulaType=='diff': 
-                self.worksheet.write_formula(cell, '=IF(AND(ISNUMBER('+old+'),ISNUMBER('+new+')),'+new+'-'+old+',"")')
+                formula = '=IF(ISNUMBER('+old+')*ISNUMBER('+new+'),'+new+'-'+old+',"")'
             elif formulaType=='pctDiff':                 
-                self.worksheet.write_formula(cell, '=IF(AND(ISNUMBER('+old+'),ISNUMBER('+new+')),'+new+'/'+old+'-1,"")')
+                formula = '=IF(ISNUMBER('+old+')*ISNUMBER('+new+'),'+new+'/'+old+'-1,"")'
+            self.worksheet.write_array_formula(self.row, first_col, self.row, last_col, formula)
             
         # sparkline
         if sparkline: 
+            cell = xl_rowcol_to_cell(self.row, 6)
             data_range = xl_rowcol_to_cell(self.row, 7) + ':' + xl_rowcol_to_cell(self.row, max_col)
-            self.worksheet.add_sparkline(self.row, 6, {'range': data_range, 
-                                                       'type': 'column', 
-                                                       'negative_points': True})                  
+            self.sparklines.append((cell, data_range))
         # increment the row
         self.row += 1
         
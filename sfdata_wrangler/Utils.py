@@ -31,17 +31,18 @@ def cleanCrosstab(rows, cols, values, aggfunc=sum, weight=None):
     Also, adds in proper row and column totals
     """
     
-    if weight is None:     
-        t = pd.crosstab(rows, cols, values, aggfunc=aggfunc, dropna=False)
-    else:
-        t = pd.crosstab(rows, cols, values*weight, aggfunc=aggfunc, dropna=False)
+    if weight is not None:     
+        values = values*weight
 
-    count = pd.crosstab(rows, cols, dropna=False)
+    # the values and the number of observations, from a single grouping
+    stats = values.groupby([rows, cols]).agg([aggfunc, 'size'])
+    t = stats.iloc[:, 0].unstack()
+    count = stats['size'].unstack(fill_value=0)
     
     t = t.mask(count==0, other=0)
         
     t['Total'] = t.sum(axis=1)
-    t = t.append(pd.Series(t.sum(axis=0), name='Total'))
+    t.loc['Total'] = t.sum(axis=0)
     
     return t
         
\ No newline at end of file
@@ -24,7 +24,6 @@ __license__     = """
 """
 
 
-import math
 import pandas as pd
 import numpy as np
 import bokeh.plotting as bk
@@ -35,105 +34,95 @@ from bokeh.models.sources import ColumnDataSource
 from dta.RoadLink import RoadLink
 
 
-def calculateSpeed(length_tt_fftt):        
+def calculateSpeed(length, tt, fftt):        
     """
-    Calculates the speed in mph given a tuple of the 
+    Calculates the speed in mph given arrays of the 
     length in miles, the travel time in seconds, and the free flow travel
     time in seconds. 
     
     Deals with missing data by using the free flow speed. 
     
-    Returns speed in mph
+    Returns an array of speeds in mph
     """    
-    (length, tt, fftt) = length_tt_fftt
-
-    if (np.isnan(tt) or tt==0):
-        tt = fftt
+    tt = np.where(np.isnan(tt) | (tt==0), fftt, tt)
     speed = length / (tt/3600.0)
 
     return speed
 
 
-def calculateTravelTimeRatio(tt_fftt):        
+def calculateTravelTimeRatio(tt, fftt):        
     """
     Calculates the ratio of the observed travel time to the
-    free flow travel time.     
-    Deals with missing data by using the free flow speed. 
+    free flow travel time, given arrays of each.     
+    Deals with missing data by using the free flow speed, so the 
+    ratio is exactly 1. 
     
-    Returns ratio. 
+    Returns an array of ratios. 
     """
-    (tt, fftt) = tt_fftt
-
-    if (np.isnan(tt) or tt==0):
-        tt = fftt
-    ratio = tt / fftt
+    ratio = np.where(np.isnan(tt) | (tt==0), 1.0, tt / fftt)
     
     return ratio
 
+# The colors to use when mapping the travel time ratio.  The first is for 
+# links with no observations, and the rest are for ratios from the 
+# matching bin up to the next.  
+LINK_COLORS = np.array(['#DCDCDC', 
+                        'green',    # 0.00
+                        'green',    # 0.50
+                        'beige',    # 1.00
+                        '#fdd49e',  # 1.50
+                        '#fdbb84',  # 2.00
+                        '#fc8d59',  # 2.50
+                        '#ef6548',  # 3.00
+                        '#d7301f',  # 3.50
+                        '#b30000',  # 4.00
+                        '#7f0000'], # 4.50
+                        dtype=object)
+LINK_TT_RATIO_BINS = np.array([0.00, 0.50, 1.00, 1.50, 2.00, 2.50, 
+                               3.00, 3.50, 4.00, 4.50])
+
+
 def getLinkTTRatioColor(tt_ratio):
     """
-    Applies a color ramp to the travel time ratio for display. 
+    Applies a color ramp to an array of travel time ratios for display. 
     
-    Returns color. 
+    Returns an array of indices into LINK_COLORS, which are much smaller
+    to keep than the color strings. 
     """    
     
-    # Specifies the color to use when mapping with a given travel time ratio
-    colorMap = {0.00: 'green',
-                0.50: 'green', 
-                1.00: 'beige', 
-                1.50: '#fdd49e',  
-                2.00: '#fdbb84',  
-                2.50: '#fc8d59',                   
-                3.00: '#ef6548',  
-                3.50: '#d7301f', 
-                4.00: '#b30000', 
-                4.50: '#7f0000'}
-
-    # if it is exactly 1, there are no observations, and make it gray
-    if tt_ratio==1.0: 
-        return '#DCDCDC'
-        
-    # otherwise, do the grouping
-    else: 
-        tt_ratio_floor = np.floor(tt_ratio*2.0) / 2.0
-        if tt_ratio_floor < min(colorMap.keys()): 
-            tt_ratio_floor = min(colorMap.keys())
-        if tt_ratio_floor > max(colorMap.keys()): 
-            tt_ratio_floor = max(colorMap.keys())
+    # group into the bins, with anything outside them in the end bins
+    tt_ratio = np.asarray(tt_ratio)
+    bins = LINK_TT_RATIO_BINS
+    color = np.clip(np.digitize(tt_ratio, bins), 1, len(bins)).astype(np.uint8)
     
-        color = colorMap[tt_ratio_floor]
+    # if it is exactly 1, there are no observations, and make it gray
+    color[tt_ratio==1.0] = 0
         
-        return color
+    return color
 
 
 def getLinkTrajectoryColor(travelTime):
     """
     Sets the color to red if there is a valid travel time, and 
-    gray otherwise.  
+    gray otherwise, for an array of travel times.  
     """    
-    if np.isfinite(travelTime):
-        return 'FireBrick'
-    else:
-        return 'Gray'
+    return np.where(np.isfinite(travelTime), 'FireBrick', 'Gray')
 
 
 def getLinkTrajectoryWidth(travelTime):
     """
-    Sets the color to red if there is a valid travel time, and 
-    gray otherwise.  
+    Sets the width to 6 if there is a valid travel time, and 
+    2 otherwise, for an array of travel times.  
     """    
-    if np.isfinite(travelTime):
-        return 6
-    else:
-        return 2
+    return np.where(np.isfinite(travelTime), 6, 2)
         
 
-def getTimeString(datetime):
+def getTimeString(datetimes):
     """
     Returns a string representation of the time, given a 
-    datetime object  
+    series of datetimes, to the second.  
     """    
-    return str(datetime.time())
+    return datetimes.dt.strftime('%H:%M:%S')
 
     
 class Visualizer():
@@ -151,6 +140,45 @@ class Visualizer():
         """   
         self.hwynet = hwynet
         self.hdffile = hdffile
+        
+        # data kept so that repeated plots don't each read it again
+        self.roadLinkData = None
+        self.linkData = {}
+        self.segmentGeometry = None
+        
+        # the datastore, opened read-only on first use and kept open 
+        # until close() is called
+        self.store = None
+
+
+    def getStore(self):
+        """
+        Returns the datastore, opening it read-only on first use. 
+        """
+        if self.store is None: 
+            self.store = pd.HDFStore(self.hdffile, mode='r')
+        return self.store
+        
+        
+    def close(self):
+        """
+        Closes the datastore, if it is open.  
+        """
+        if self.store is not None: 
+            self.store.close()
+            self.store = None
+
+
+    def getRoadLinkDataFrame(self):
+        """
+        Returns the network links as a dataframe, read from the 
+        network on first use.  
+        
+        The result is shared by later calls, so it should not be modified. 
+        """
+        if self.roadLinkData is None: 
+            self.roadLinkData = self.hwynet.getRoadLinkDataFrame()
+        return self.roadLinkData
 
 
     def getLinkData(self, date='2009-02-13'):
@@ -159,50 +187,115 @@ class Visualizer():
         each link, and with speed and travel time information
         attached to use for plotting. 
         
+        The result is kept for each date and shared by later calls, so 
+        it should not be modified. 
         """   
+        if date in self.linkData: 
+            return self.linkData[date]
         
         # start with the network links as a dataframe
-        df = self.hwynet.getRoadLinkDataFrame()
+        links = self.getRoadLinkDataFrame()
+        length = links['LENGTH'].values
+        fftime = links['FFTIME'].values
         
-        # now get the link speeds for the date, and for each hour
-        store = pd.HDFStore(self.hdffile)
-    
-        for hour in range(0,24):
-            h = str(hour)
-                
-            # get the data
-            query = "date==Timestamp('" + date + "') and hour==" + h
-            obs_df = store.select('link_tt', where=query) 
-    
-            # append the hour to the end of each column name for this query
-            obs_df.drop('date', axis=1, inplace=True)
-            obs_df.rename(columns=lambda x: x+h, inplace=True)
-    
-            # merge, keeping all links
-            df = pd.merge(df, obs_df, how='left', 
-                        left_on=['ID'], right_on=['link_id'+h])
+        # now get the link speeds for the date, all hours at once, 
+        # reading only the fields that are plotted
+        store = self.getStore()
+        query = "date==Timestamp('" + date + "')"
+        obs_df = store.select('link_tt', where=query, 
+                              columns=['link_id', 'hour', 'tt_mean', 'observations']) 
+        
+        # line them up as matrices with a row for each link and a column 
+        # for each hour, keeping all links and hours
+        hours = list(range(0,24))
+        
+        row = pd.Index(links['ID']).get_indexer(obs_df['link_id'])
+        col = obs_df['hour'].values
+        keep = (row >= 0) & (col >= 0) & (col < len(hours))
+        
+        obs = OrderedDict()
+        for field in obs_df.columns: 
+            obs[field] = np.full((len(links), len(hours)), np.nan)
+            obs[field][row[keep], col[keep]] = obs_df[field].values[keep]
                             
-            """ Calculations start here """
-            # there are zero observations if its not in the righthand database
-            df['observations'+h].replace(to_replace=np.nan, value=0, inplace=True)
+        """ Calculations start here, for all hours at once """
+        # there are zero observations if its not in the righthand database
+        obs['observations'] = np.nan_to_num(obs['observations'])
+        
+        # calculate some extra fields
+        obs['speed'] = calculateSpeed(length[:,np.newaxis], 
+                                      obs['tt_mean'], 
+                                      fftime[:,np.newaxis])
+        
+        obs['tt_ratio'] = calculateTravelTimeRatio(obs['tt_mean'], 
+                                                   fftime[:,np.newaxis])
             
-            # calculate some extra fields
-            length_tt_fftt = pd.Series(list(zip(df['LENGTH'], df['tt_mean'+h], df['FFTIME'])))
-            df['speed'+h] = length_tt_fftt.apply(calculateSpeed)
-                
-            tt_fftt = pd.Series(list(zip(df['tt_mean'+h], df['FFTIME'])))
-            df['tt_ratio'+h] = tt_fftt.apply(calculateTravelTimeRatio)
-                
-            # map the link colors based on the travel time ratio
-            df['color'+h] = df['tt_ratio'+h].apply(getLinkTTRatioColor)
-                                
-        store.close()
-    
+        # map the link colors based on the travel time ratio
+        obs['color'] = getLinkTTRatioColor(obs['tt_ratio'])
+        
+        # the plots don't need the fields at full precision, and the
+        # observations are counts
+        obs['observations'] = obs['observations'].astype(np.int32)
+        for field in ['speed', 'tt_ratio']: 
+            obs[field] = obs[field].astype(np.float32)
+        
+        # and the columns for each hour, with the hour appended to the 
+        # end of each column name
+        columns = OrderedDict()
+        for hour in hours: 
+            for field in obs: 
+                columns[field+str(hour)] = obs[field][:,hour]
+        
+        df = pd.concat([links, pd.DataFrame(columns, index=links.index)], axis=1)
         df['color'] = df['color0']  
         
+        self.linkData[date] = df
         return df
                         
 
+    def getSegmentGeometry(self, df):
+        """
+        Returns a dictionary with the geometry of each link segment, 
+        and the link each segment belongs to.  
+        
+        This only depends on the network, so it is kept and reused for
+        as long as the links are the same. 
+        
+        df - a dataframe with one record for each link. 
+        """
+        if (self.segmentGeometry is not None and 
+            np.array_equal(self.segmentGeometry['ids'], df['ID'].values)): 
+            return self.segmentGeometry
+            
+        # the shape points of all the links end to end, with the 
+        # position of the last point of each link
+        npoints = np.array([len(xvals) for xvals in df['X']])
+        last = np.cumsum(npoints) - 1
+        x = np.concatenate([np.asarray(xvals, dtype=float) for xvals in df['X']])
+        y = np.concatenate([np.asarray(yvals, dtype=float) for yvals in df['Y']])
+        
+        # the steps between consecutive points, keeping only those that 
+        # start at a point other than the last of a link, which are the 
+        # segments, and the link each segment belongs to
+        start = np.delete(np.arange(len(x)-1), last[:-1])
+        link = np.repeat(np.arange(len(df)), npoints-1)
+        
+        dx = np.diff(x)[start]
+        dy = np.diff(y)[start]
+        
+        # typed arrays are sent to the browser as binary, and the 
+        # plots don't need them at full precision
+        self.segmentGeometry = dict(ids=df['ID'].values, 
+                                    link=link, 
+                                    xmid=((x[start]+x[start+1])/2.0).astype(np.float32),
+                                    ymid=((y[start]+y[start+1])/2.0).astype(np.float32), 
+                                    length=np.hypot(dx, dy).astype(np.float32), 
+                                    width=(df['LANES'].values[link] * RoadLink.DEFAULT_LANE_WIDTH * 1.5).astype(np.float32),
+                                    angle=(np.arctan2(dy, dx) + np.pi/2.0).astype(np.float32))
+        
+        return self.segmentGeometry
+        
+
     def getSegmentRectangleData(self, df):
         """
         Converts a link dataframe into a dictionary with 
@@ -213,61 +306,27 @@ class Visualizer():
 
         df - a dataframe with one record for each link segment.  
         """   
-        xmid = []
-        ymid = []
-        length = []
-        width = []
-        angle = []
-
-        link_id = []
-        label = []
-        ffspeed = []
-
-        # these lists have one for each hour
-        speed = []
-        observations = []
-        for h in range(0,24):
-            speed.append([])
-            observations.append([])
+        geometry = self.getSegmentGeometry(df)
+        link = geometry['link']
         
-        # one record for each midpoint
-        for i, row in df.iterrows(): 
-            xvals = row['X']
-            yvals = row['Y']
-
-            for (x1, x2, y1, y2) \
-                in list(zip(xvals[:-1], xvals[1:], yvals[:-1], yvals[1:])):
-                
-                xmid.append((x1+x2)/2.0)
-                ymid.append((y1+y2)/2.0)
-                
-                length.append(math.sqrt(((x1-x2)**2) + ((y1-y2)**2)))
-                width.append(row['LANES'] * RoadLink.DEFAULT_LANE_WIDTH * 1.5)
-                
-                # calculate angle in radians
-                angle.append(math.atan2(y2-y1, x2-x1) + np.pi/2.0)
-
-                link_id.append(row['ID'])
-                label.append(row['LABEL'])
-                ffspeed.append(row['FFSPEED'])
-                
-                # these have one for each hour
-                for h in range(0,23):
-                    speed[h].append(row['speed'+str(h)])
-                    observations[h].append(row['observations'+str(h)])
-        
-        data=dict(xmid=xmid,
-                  ymid=ymid, 
-                  length=length, 
-                  width=width,
-                  angle=angle,
-                  link_id=link_id, 
-                  label=label, 
-                  ffspeed=ffspeed)
+        data=dict(xmid=geometry['xmid'],
+                  ymid=geometry['ymid'], 
+                  length=geometry['length'], 
+                  width=geometry['width'],
+                  angle=geometry['angle'],
+                  link_id=df['ID'].values[link].astype(np.int32), 
+                  label=df['LABEL'].values[link], 
+                  ffspeed=df['FFSPEED'].values[link].astype(np.float32))
+        
+        # these have one for each hour, expanded together as a matrix
+        # with a row for each link and a column for each hour
+        hours = [str(h) for h in range(0,24)]
+        speed = df[['speed'+h for h in hours]].values[link]
+        observations = df[['observations'+h for h in hours]].values[link]
         
         for h in range(0,24):
-            data['speed'+str(h)]        = speed[h]
-            data['observations'+str(h)] = observations[h]
+            data['speed'+str(h)]        = speed[:,h]
+            data['observations'+str(h)] = observations[:,h]
         
         return data
 
@@ -282,25 +341,19 @@ class Visualizer():
         
         df2 = df[np.isfinite(df['travel_time'])]
         
-        x = []
-        y = []
-        angle = []
-        text = []        
-        for i, row in df2.iterrows(): 
-            xvals = row['X']
-            yvals = row['Y']            
-            xmid = (xvals[0] + xvals[-1]) / 2.0 
-            ymid = (yvals[0] + yvals[-1]) / 2.0 
-            
-            # calculate angle in radians
-            deltax = xvals[-1] - xvals[0]
-            deltay = yvals[-1] - yvals[0]
-            a = math.atan2(deltay, deltax) + np.pi
-            
-            x.append(xmid)
-            y.append(ymid)
-            text.append(str(int(round(row['travel_time']))))
-            angle.append(a)
+        # only the first and last points of each link are needed
+        x0 = np.array([xvals[0] for xvals in df2['X']], dtype=float)
+        xN = np.array([xvals[-1] for xvals in df2['X']], dtype=float)
+        y0 = np.array([yvals[0] for yvals in df2['Y']], dtype=float)
+        yN = np.array([yvals[-1] for yvals in df2['Y']], dtype=float)
+        
+        x = (x0 + xN) / 2.0 
+        y = (y0 + yN) / 2.0 
+        
+        # calculate angle in radians
+        angle = np.arctan2(yN - y0, xN - x0) + np.pi
+        
+        text = df2['travel_time'].round().astype(int).astype(str).values
         
         df3 = pd.DataFrame({'x':x, 'y':y, 'angle':angle, 'text':text})
         return df3
@@ -317,22 +370,36 @@ class Visualizer():
 
         # setup
         bk.output_file(html_outfile, title="Trajectory Validation")
-        store = pd.HDFStore(self.hdffile)
-        net_df = self.hwynet.getRoadLinkDataFrame()
+        store = self.getStore()
+        net_df = self.getRoadLinkDataFrame()
+
+        # get the data for all the cases at once
+        dates = sorted(set([pd.Timestamp(date) for date, cab_id, trip_id in trajSpecs]))
+        cabs  = sorted(set([int(cab_id) for date, cab_id, trip_id in trajSpecs]))
+        trips = sorted(set([int(trip_id) for date, cab_id, trip_id in trajSpecs]))
+        
+        query = 'date=dates & cab_id=cabs & trip_id=trips'
+        all_point_df = store.select('trip_points', where=query) 
+        all_traj_df = store.select('trajectories', where=query)
+        
+        # and split it by case, which also drops any combinations of 
+        # the dates, cabs and trips that weren't asked for
+        keys = ['date', 'cab_id', 'trip_id']
+        points = dict(list(all_point_df.groupby(keys)))
+        trajectories = dict(list(all_traj_df.groupby(keys)))
 
         plots = []
         for date, cab_id, trip_id in trajSpecs:
             
             # get the data for this case
-            query = "date==Timestamp('" + date + "') and cab_id==" + cab_id \
-                    + " and trip_id==" + trip_id
-            point_df = store.select('trip_points', where=query) 
-            traj_df = store.select('trajectories', where=query)
+            key = (pd.Timestamp(date), int(cab_id), int(trip_id))
+            point_df = points.get(key, all_point_df.iloc[:0]).copy()
+            traj_df = trajectories.get(key, all_traj_df.iloc[:0])
 
             # join trajectory data to network, and set the color
             df = pd.merge(net_df, traj_df, how='left', left_on=['ID'], right_on=['link_id'])
-            df['color'] = df['travel_time'].apply(getLinkTrajectoryColor)
-            df['width'] = df['travel_time'].apply(getLinkTrajectoryWidth)
+            df['color'] = getLinkTrajectoryColor(df['travel_time'].values)
+            df['width'] = getLinkTrajectoryWidth(df['travel_time'].values)
 
             # define the ranges, be sure to keep it square
             # to avoid distortion
@@ -351,7 +418,7 @@ class Visualizer():
                 y_range = None
 
             # generate lables
-            point_df['text'] = point_df['time'].apply(getTimeString)
+            point_df['text'] = getTimeString(point_df['time'])
             traj_mid_df = self.getTrajectoryLinkMidpointDf(df)
 
             # set up the plot
@@ -407,8 +474,6 @@ class Visualizer():
         # add them all together in a grid plot
         gp = bk.gridplot(plots)
         bk.show(gp)
-                        
-        store.close()
 
 
     def createNetworkPlot(self, html_outfile, date='2013-02-13', hour='17'):
@@ -445,11 +510,11 @@ class Visualizer():
                   
         # TODO - fix/remove this when bokeh makes hover tool work for lines
         # see: https://github.com/bokeh/bokeh/issues/2031       
-        p.rect(x=segmentData['xmid'], 
-               y=segmentData['ymid'], 
-               height=segmentData['length'], 
-               width=segmentData['width'], 
-               angle=segmentData['angle'], 
+        p.rect(x='xmid', 
+               y='ymid', 
+               height='length', 
+               width='width', 
+               angle='angle', 
                source=ColumnDataSource(segmentData),
                line_alpha=0,
                fill_alpha=0)
@@ -463,11 +528,19 @@ class Visualizer():
             ("OBSERVATIONS", "@observations"+hour)
         ])
 
-        # plot the links
-        p.multi_line(xs=df['X'], 
-                     ys=df['Y'], 
-                     line_width=df['LANES'],  
-                     line_color=df['color'+hour])      
+        # plot the links, from a source with just the columns used.  The
+        # shape points are typed arrays, so they go to the browser as
+        # binary, and the plot doesn't need them at full precision
+        linkData = dict(X=[np.asarray(xvals, dtype=np.float32) for xvals in df['X']], 
+                        Y=[np.asarray(yvals, dtype=np.float32) for yvals in df['Y']], 
+                        LANES=df['LANES'].values, 
+                        color=LINK_COLORS[df['color'+hour].values])
+        
+        p.multi_line(xs='X', 
+                     ys='Y', 
+                     line_width='LANES',  
+                     line_color='color', 
+                     source=ColumnDataSource(linkData))      
                      
         # write to file and show
         bk.show(p)